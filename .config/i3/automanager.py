@@ -1,18 +1,418 @@
 #!/usr/bin/env python3
 
 import i3ipc
+from i3ipc.aio import Connection
 
+import asyncio
+import bisect
+import ctypes
+import ctypes.util
+import datetime
+import fnmatch
 import json
 import os
 import pathlib
+import time
 from collections import defaultdict
 import logging
+import re
+import struct
 
 logger = logging.getLogger(__name__)
 
-i3 = i3ipc.Connection()
+# Seconds the tree mirror is trusted before handlers re-fetch the real tree
+RECONCILE_INTERVAL = 60
+# Seconds to collect window events before running one workspace rename pass
+RENAME_DEBOUNCE = 0.25
+# Events buffered per event type before new ones are dropped
+EVENT_QUEUE_SIZE = 256
+# Seconds a new window settles before it is moved to its forced workspace
+PLACEMENT_DELAY = 0.25
+# Seconds a placement survives its window closing early (splash screens,
+# updaters) to be taken over by the next window of the same class
+PLACEMENT_TIMEOUT = 15
+# Rule keys are "[field:][kind:]pattern" (see RuleSet)
+RULE_FIELDS = ['class', 'instance', 'title']
+RULE_KINDS = ['exact', 'prefix', 'glob', 'regex']
+# Keys of the shared settings file automanager acts on; rewrites that only
+# change other keys (eg: special_dmenu_handler's dmenu_injection) are ignored
+SETTINGS_KEYS = ['app_force_workspace', 'app_rename']
+# Seconds to wait after the settings file is written before reloading it
+SETTINGS_RELOAD_DELAY = 0.2
+# Seconds between writes of the stats file (also written on an automanager::stats tick)
+STATS_DUMP_INTERVAL = 300
+# Upper bounds (milliseconds) of the latency histogram buckets; one more bucket catches the rest
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
 
-def auto_assign_new_to_workspace(i3, e):
+class LatencyHistogram():
+    """
+        Count, mean, max and fixed-bucket histogram of observed durations
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def observe(self, seconds):
+        ms = seconds * 1000
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+
+    def percentile(self, pct):
+        # Upper bound of the bucket holding the pct-th observation
+        target = self.count * pct / 100
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= target:
+                return round(min(bound, self.max), 3)
+        return round(self.max, 3)
+
+    def summary(self):
+        return {'n': self.count,
+                'mean_ms': round(self.total / self.count, 3) if self.count > 0 else None,
+                'p50_ms': self.percentile(50) if self.count > 0 else None,
+                'p95_ms': self.percentile(95) if self.count > 0 else None,
+                'max_ms': round(self.max, 3),
+                'buckets': self.buckets,
+                }
+
+# Handler run time, IPC round trips (by request type) and queue lag (by queue).
+# Worker handler times include any debounce wait; the passes they debounce
+# (rename_workspaces) are also timed on their own
+metrics = {'handlers': defaultdict(LatencyHistogram),
+           'ipc': defaultdict(LatencyHistogram),
+           'lag': defaultdict(LatencyHistogram),
+           }
+started = time.time()
+# Where stats are dumped, set by main()
+stats_path = None
+
+def timed(name, handler):
+    """
+        Wrap a synchronous event handler so its run time is recorded under name
+    """
+    def wrapper(i3, e):
+        start = time.perf_counter()
+        try:
+            return handler(i3, e)
+        finally:
+            metrics['handlers'][name].observe(time.perf_counter() - start)
+    return wrapper
+
+# i3ipc.aio sends every request over one command socket without locking it;
+# workers run concurrently, so round trips must not interleave
+ipc_lock = asyncio.Lock()
+
+async def i3_command(i3, command):
+    async with ipc_lock:
+        start = time.perf_counter()
+        try:
+            return await i3.command(command)
+        finally:
+            metrics['ipc']['command'].observe(time.perf_counter() - start)
+
+async def i3_tree(i3):
+    async with ipc_lock:
+        start = time.perf_counter()
+        try:
+            return await i3.get_tree()
+        finally:
+            metrics['ipc']['get_tree'].observe(time.perf_counter() - start)
+
+class TreeMirror():
+    """
+        Local copy of the workspaces and their windows, kept current from the
+        window/workspace event stream so handlers don't need a get_tree()
+        round trip per event.
+
+        Events that don't say where a window ended up (moves, output changes)
+        mark the mirror dirty; the next query re-fetches the tree once. Events
+        arriving while a fetch is in flight may or may not be in the snapshot,
+        so the mirror stays dirty after such a fetch. The mirror is also re-fetched every RECONCILE_INTERVAL seconds in case an
+        event was missed. New windows are appended to their workspace, so leaf
+        order may differ from i3's until the next reconciliation.
+    """
+    def __init__(self):
+        # workspace con_id: {'num': int, 'name': str, 'windows': [con_id, ...]}
+        self.workspace_map = dict()
+        # window con_id: {'class': str, 'instance': str, 'title': str, 'workspace': con_id}
+        self.window_map = dict()
+        self.class_counts = defaultdict(int)
+        self.focused_workspace = None
+        self.dirty = True
+        self.synced_at = None
+        # Events seen by update(), to detect ones racing a sync()
+        self.event_count = 0
+
+    async def sync(self, i3):
+        event_count = self.event_count
+        tree = await i3_tree(i3)
+        self.workspace_map.clear()
+        self.window_map.clear()
+        self.class_counts.clear()
+        for ws in tree.workspaces():
+            self.workspace_map[ws.id] = {'num': ws.num, 'name': ws.name, 'windows': list()}
+            for leaf in ws.leaves():
+                self._add_window(leaf, ws.id)
+        focused = tree.find_focused()
+        focused_ws = focused.workspace() if focused is not None else None
+        self.focused_workspace = focused_ws.id if focused_ws is not None else None
+        self.dirty = self.event_count != event_count
+        self.synced_at = time.monotonic()
+        logger.debug(f"Tree mirror synced: {len(self.workspace_map)} workspaces, {len(self.window_map)} windows")
+
+    async def _fresh(self, i3):
+        if self.dirty or time.monotonic() - self.synced_at > RECONCILE_INTERVAL:
+            await self.sync(i3)
+
+    def _add_window(self, con, ws_id):
+        if con.id in self.window_map:
+            self._remove_window(con.id)
+        self.window_map[con.id] = {'class': con.window_class,
+                                   'instance': con.window_instance,
+                                   'title': con.name,
+                                   'workspace': ws_id,
+                                   }
+        self.workspace_map[ws_id]['windows'].append(con.id)
+        self.class_counts[con.window_class] += 1
+
+    def _remove_window(self, con_id):
+        window = self.window_map.pop(con_id)
+        if window['workspace'] in self.workspace_map:
+            self.workspace_map[window['workspace']]['windows'].remove(con_id)
+        self.class_counts[window['class']] -= 1
+
+    def update(self, i3, e):
+        """
+            Event handler: apply a window::* or workspace::* event to the mirror.
+            Runs directly on the event reader (no IPC) so the mirror follows
+            i3's event order
+        """
+        self.event_count += 1
+        if self.dirty:
+            return
+        if isinstance(e, i3ipc.WindowEvent):
+            con = e.container
+            if e.change == 'new':
+                if self.focused_workspace not in self.workspace_map:
+                    self.dirty = True
+                    return
+                self._add_window(con, self.focused_workspace)
+            elif e.change == 'close':
+                if con.id in self.window_map:
+                    self._remove_window(con.id)
+            elif e.change == 'focus':
+                if con.id in self.window_map:
+                    self.focused_workspace = self.window_map[con.id]['workspace']
+            elif e.change == 'title':
+                if con.id in self.window_map:
+                    self.window_map[con.id]['title'] = con.name
+            elif e.change == 'move':
+                # The event does not carry the destination workspace
+                self.dirty = True
+        elif isinstance(e, i3ipc.WorkspaceEvent):
+            ws = e.current
+            if e.change in ['init', 'focus']:
+                if ws.id not in self.workspace_map:
+                    self.workspace_map[ws.id] = {'num': ws.num, 'name': ws.name, 'windows': list()}
+                if e.change == 'focus':
+                    self.focused_workspace = ws.id
+            elif e.change == 'empty':
+                if ws.id in self.workspace_map and len(self.workspace_map[ws.id]['windows']) == 0:
+                    del self.workspace_map[ws.id]
+                else:
+                    self.dirty = True
+            elif e.change == 'rename':
+                if ws.id in self.workspace_map:
+                    self.workspace_map[ws.id]['name'] = ws.name
+                else:
+                    self.dirty = True
+            else:
+                # move (to another output), reload, restored
+                self.dirty = True
+
+    async def workspaces(self, i3):
+        """
+            Returns [{'num': int, 'name': str, 'windows': [con_id, ...]}, ...]
+        """
+        await self._fresh(i3)
+        return list(self.workspace_map.values())
+
+    def window(self, con_id):
+        # Only valid for con_ids just returned by workspaces()
+        return self.window_map[con_id]
+
+    async def count_class(self, i3, window_class):
+        await self._fresh(i3)
+        return self.class_counts[window_class]
+
+mirror = TreeMirror()
+
+class EventQueue():
+    """
+        Bounded queue drained by one worker task per event type, so a slow
+        handler only delays events of its own type. put() is the i3ipc
+        handler: it never waits, so reading i3's event socket is never
+        blocked. When the queue is full the event is dropped and counted
+    """
+    def __init__(self, name, handler, maxsize=EVENT_QUEUE_SIZE):
+        self.name = name
+        self.handler = handler
+        self.queue = asyncio.Queue(maxsize)
+        self.stats = {'received': 0,
+                      'handled': 0,
+                      'coalesced': 0,
+                      'failed': 0,
+                      'dropped': 0,
+                      'high_water': 0,
+                      'max_lag': 0.0,
+                      }
+
+    def put(self, i3, e):
+        self.stats['received'] += 1
+        try:
+            self.queue.put_nowait((i3, e, time.monotonic()))
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            logger.warning(f"Event queue '{self.name}' is full ({self.queue.maxsize}), dropped {e.change} event ({self.stats['dropped']} dropped so far)")
+            return
+        if self.queue.qsize() > self.stats['high_water']:
+            self.stats['high_water'] = self.queue.qsize()
+            logger.debug(f"Event queue '{self.name}' reached depth {self.stats['high_water']}")
+
+    def drain(self):
+        """
+            Take every event currently waiting, for handlers that coalesce them
+        """
+        drained = list()
+        while not self.queue.empty():
+            drained.append(self.queue.get_nowait())
+            self.queue.task_done()
+            self.observe_lag(drained[-1][2])
+        self.stats['coalesced'] += len(drained)
+        return drained
+
+    def observe_lag(self, queued_at):
+        lag = time.monotonic() - queued_at
+        self.stats['max_lag'] = max(self.stats['max_lag'], lag)
+        metrics['lag'][self.name].observe(lag)
+
+    async def worker(self):
+        while True:
+            i3, e, queued_at = await self.queue.get()
+            self.observe_lag(queued_at)
+            start = time.perf_counter()
+            try:
+                await self.handler(i3, e)
+                self.stats['handled'] += 1
+            except Exception as ex:
+                # Don't crash my script but help me debug it
+                self.stats['failed'] += 1
+                logger.error(f"{type(ex)} Exception during {self.handler.__name__}(): {ex}")
+            finally:
+                metrics['handlers'][self.handler.__name__].observe(time.perf_counter() - start)
+                self.queue.task_done()
+
+# Event type: EventQueue, populated by serve()
+queues = dict()
+
+class PlacementQueue():
+    """
+        Deferred placement of new windows onto their forced workspace.
+        Placements are keyed by con_id and issued PLACEMENT_DELAY seconds
+        after the first one queued, all in one command of
+        '[con_id=N] move container to workspace "name"' entries, so the right
+        window moves even if focus went elsewhere in the meantime, and
+        workspace names are looked up once per batch.
+
+        If a window closes before it is placed (a slow-launching app's splash
+        or updater), its placement is handed over to the next window of the
+        same class opened within PLACEMENT_TIMEOUT seconds
+    """
+    def __init__(self):
+        # con_id: {'class': str, 'target': int}
+        self.pending = dict()
+        # class: {'target': int, 'expires': monotonic time}
+        self.handover = dict()
+        self.flush_task = None
+        self.stats = {'queued': 0, 'placed': 0, 'handed_over': 0, 'expired': 0}
+
+    def schedule(self, i3, con_id, window_class, target):
+        self.pending[con_id] = {'class': window_class, 'target': target}
+        self.stats['queued'] += 1
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush(i3))
+
+    def claim(self, window_class):
+        """
+            Returns the target handed over to window_class, if any and not expired
+        """
+        entry = self.handover.pop(window_class, None)
+        if entry is None:
+            return None
+        if entry['expires'] < time.monotonic():
+            self.stats['expired'] += 1
+            return None
+        self.stats['handed_over'] += 1
+        return entry['target']
+
+    def forget(self, i3, e):
+        """
+            Event handler for window::close
+        """
+        entry = self.pending.pop(e.container.id, None)
+        now = time.monotonic()
+        for window_class in [key for key, value in self.handover.items() if value['expires'] < now]:
+            del self.handover[window_class]
+            self.stats['expired'] += 1
+        if entry is None:
+            return
+        logger.info(f"Container {e.container.id} <class='{entry['class']}'> closed before placement, hand workspace {entry['target']} to its successor")
+        self.handover[entry['class']] = {'target': entry['target'], 'expires': now + PLACEMENT_TIMEOUT}
+
+    async def flush(self, i3):
+        await asyncio.sleep(PLACEMENT_DELAY)
+        self.flush_task = None
+        due, self.pending = self.pending, dict()
+        if len(due) == 0:
+            return
+        # Determine workspace names (they may be renamed)
+        names = dict((ws['num'], ws['name']) for ws in await mirror.workspaces(i3))
+        commands = list()
+        follow = None
+        for con_id, entry in due.items():
+            if entry['target'] in names:
+                name = names[entry['target']]
+                logger.info(f"Place container {con_id} <class='{entry['class']}'> on workspace {entry['target']} as name '{name}'")
+                # Follow the workspace with focus -- if it wasn't active, it is now
+                follow = name
+            else:
+                # Workspace does not currently exist, but you can create it
+                # You don't need to invoke rename(), it will get called naturally
+                name = str(entry['target'])
+                logger.info(f"Place container {con_id} <class='{entry['class']}'> on NEW workspace {name}")
+            commands.append(f'[con_id={con_id}] move container to workspace "{name}"')
+        if follow is not None:
+            commands.append(f'workspace "{follow}"')
+        status = await i3_command(i3, "; ".join(commands))
+        for command, reply in zip(commands, status):
+            if reply.success:
+                self.stats['placed'] += command.startswith('[con_id=')
+            else:
+                logger.error(f"{command}: {reply.error}")
+
+placements = PlacementQueue()
+
+async def auto_assign_new_to_workspace(i3, e):
     """
         Smarter way to auto-configure certain applications to open in particular
         workspaces (when user-defined). They can still be moved elsewhere
@@ -22,18 +422,14 @@ def auto_assign_new_to_workspace(i3, e):
         force the window to open in that workspace/no particular workspace
         instead
     """
-    remaps = defaultdict(type(None), settings['app_force_workspace'])
-
     # Learn the class of what just opened
-    container_class = e.ipc_data['container']['window_properties']['class']
-    remap_container_class = container_class
-    # Special case for steam apps that aren't given a specific override
-    if remap_container_class.startswith('steam_app_') and not remaps[remap_container_class]:
-        remap_container_class = 'steam_app_'
-    # Default remapping ONLY applies to first window of given class
-    ws_target = None
-    if len(i3.get_tree().find_classed(container_class)) < 2:
-        ws_target = remaps[remap_container_class]
+    container = e.container
+    container_class = container.window_class
+    # Default remapping ONLY applies to first window of given class, or the
+    # window replacing one that closed before it could be placed
+    ws_target = placements.claim(container_class)
+    if ws_target is None and await mirror.count_class(i3, container_class) < 2:
+        ws_target = rules['app_force_workspace'].match(container_class, container.window_instance, container.name)
     if 'no_default' in settings['ticks']:
         ws_target = None
         # Clear the signal
@@ -42,111 +438,188 @@ def auto_assign_new_to_workspace(i3, e):
 
     # Determine if mapped class or not
     if ws_target is not None:
-        # Determine workspace name (it may be renamed)
-        try:
-            for ws in i3.get_tree().workspaces():
-                # Always parse names correctly by number
-                if ':' not in ws.name:
-                    ws_num = int(ws.name)
-                else:
-                    ws_num = int(ws.name.split(':',1)[0])
-                logger.debug(f"Inspect workspace {ws.name} as {ws_num}")
-
-                # Found the workspace to use
-                if ws_num == ws_target:
-                    logger.info(f"New container <class='{container_class}'> targets window {ws_target} as name '{ws.name}'.")
-                    # BUG: If an application is slow-to-launch or does pre-launch stuff that takes nontrivial time, this OFTEN moves the previously active window to the workspace!
-                    # Possible solutions:
-                    # 1) Ignore-once for discord/etc so it hooks the REAL opening?
-                    # 2) Sleep a bit on these apps to wait for real initialization?
-                    # 3) Can the command below target specific container?
-                    command = f'move container to workspace "{ws.name}"'
-                    status = i3.command(command)
-                    if not status[0].success:
-                        logger.error(status[0].error)
-                        return
-                    # Follow the workspace with focus -- if it wasn't active, it is now
-                    logger.info(f"Change focus to workspace '{ws.name}'")
-                    command = f'workspace "{ws.name}"'
-                    status = i3.command(command)
-                    if not status[0].success:
-                        logger.error(status[0].error)
-                        return
-                    # Halt processing this function
-                    return
-            logger.info(f"New container <class='{container_class}'> targets NEW window {ws_target}. Create it.")
-            # Workspace does not currently exist, but you can create it
-            # You don't need to invoke rename(), it will get called naturally
-            command = f'move container to workspace "{ws_target}"'
-            status = i3.command(command)
-            if not status[0].success:
-                logger.error(status[0].error)
-                return
-        except:
-            # Don't crash my script but help me debug it
-            logger.error(f"{type(e)} Exception during auto_assign_new_to_workspace()")
-            try:
-                logger.error(e.msg)
-            except:
-                return
+        logger.info(f"New container {container.id} <class='{container_class}'> targets workspace {ws_target}, queue placement")
+        placements.schedule(i3, container.id, container_class, ws_target)
     else:
         logger.debug(f"New container <class='{container_class}'> has no specialized target.")
         #logger.debug("Called rename() due to new container (via auto_assign_new_to_workspace())")
         e.change += " (via auto_assign_new_to_workspace())"
         # Just update the name of the workspace as needed
-        rename(i3, e)
+        queues['rename'].put(i3, e)
+
+class RuleSet():
+    """
+        Window rules compiled once from a settings mapping of rule key: value.
+        Keys are "[field:][kind:]pattern":
+            field: class (default), instance or title
+            kind: exact (default), prefix, glob or regex (searched anywhere)
+        so plain keys keep meaning "exact window class". A bare "steam_app_"
+        key keeps its old meaning of a prefix rule for Steam games.
+
+        Lookups check each field in RULE_FIELDS order; within a field, exact
+        rules win over patterns, prefixes are tried longest first, then globs
+        and regexes in settings order. All patterns of a field are combined
+        into one regex so a lookup is one dict probe plus one regex match;
+        fields with a regex defining groups (whose numbering or names would
+        clash once combined) are matched rule by rule instead.
+        Class and instance results are memoized; titles change too often to
+        be worth it
+    """
+    def __init__(self, name, mapping):
+        self.name = name
+        self.exact = dict((field, dict()) for field in RULE_FIELDS)
+        self.patterns = dict((field, list()) for field in RULE_FIELDS)
+        self.combined = dict()
+        self.memo = dict((field, dict()) for field in RULE_FIELDS if field != 'title')
+        for key, value in mapping.items():
+            field, kind, pattern = self.parse_key(key)
+            if kind == 'exact':
+                self.exact[field][pattern] = value
+                continue
+            if kind == 'prefix':
+                regex = re.escape(pattern)
+            elif kind == 'glob':
+                regex = fnmatch.translate(pattern)
+            else:
+                regex = f".*?(?:{pattern})"
+            try:
+                compiled = re.compile(regex, re.DOTALL)
+            except re.error as e:
+                logger.error(f"Skip {self.name} rule '{key}': invalid pattern ({e})")
+                continue
+            self.patterns[field].append((kind, len(pattern), compiled, value))
+        for field, patterns in self.patterns.items():
+            if len(patterns) == 0:
+                continue
+            # Stable sort: prefixes longest first, globs/regexes keep settings order
+            patterns.sort(key=lambda _: (_[0] != 'prefix', -_[1] if _[0] == 'prefix' else 0))
+            if any(_[2].groups > 0 for _ in patterns):
+                logger.debug(f"{self.name} {field} rules define groups, match them one by one")
+                continue
+            try:
+                self.combined[field] = re.compile("|".join(f"(?P<r{idx}>{_[2].pattern})" for idx, _ in enumerate(patterns)), re.DOTALL)
+            except re.error as e:
+                logger.warning(f"Cannot combine {self.name} {field} rules ({e}), match them one by one")
+
+    @staticmethod
+    def parse_key(key):
+        field, kind, pattern = 'class', 'exact', key
+        head, sep, rest = pattern.partition(':')
+        if sep and head in RULE_FIELDS:
+            field, pattern = head, rest
+            head, sep, rest = pattern.partition(':')
+        if sep and head in RULE_KINDS:
+            kind, pattern = head, rest
+        # Backwards compatibility with the old hard-coded steam fallback
+        if (field, kind, pattern) == ('class', 'exact', 'steam_app_'):
+            kind = 'prefix'
+        return field, kind, pattern
+
+    def match_field(self, field, value):
+        if value is None:
+            return None
+        if value in self.exact[field]:
+            return self.exact[field][value]
+        if field not in self.combined:
+            for _, _, compiled, result in self.patterns[field]:
+                if compiled.match(value) is not None:
+                    return result
+            return None
+        match = self.combined[field].match(value)
+        if match is None:
+            return None
+        return self.patterns[field][int(match.lastgroup[1:])][3]
+
+    def match(self, window_class, window_instance=None, window_title=None):
+        """
+            Returns the value of the first rule matching the window, else None
+        """
+        for field, value in zip(RULE_FIELDS, [window_class, window_instance, window_title]):
+            if field in self.memo:
+                if value not in self.memo[field]:
+                    self.memo[field][value] = self.match_field(field, value)
+                result = self.memo[field][value]
+            else:
+                result = self.match_field(field, value)
+            if result is not None:
+                return result
+        return None
 
-class AutoCapitalizeDictionary(dict):
+def compile_rules(settings):
+    return {'app_force_workspace': RuleSet('app_force_workspace', settings['app_force_workspace']),
+            'app_rename': RuleSet('app_rename', settings['app_rename']),
+            }
+
+# Compiled settings rules, populated by main() and swapped by reload_settings()
+rules = dict()
+
+def display_name(window):
     """
-        Similar to a defaultdict, but I need to operate on the missing key itself
-        So we just do a similar thing and override the __missing__() function
+        Configured name for a mirrored window, otherwise its capitalized class
     """
-    def __missing__(self, key):
-        # We don't know how to make these keys, don't fix them but raise a regular KeyError
-        if (not hasattr(key,'capitalize')) or (not callable(getattr(key,'capitalize'))):
-            raise KeyError(key)
-        self[key] = key.capitalize()
-        return self[key]
+    name = rules['app_rename'].match(window['class'], window['instance'], window['title'])
+    if name is None:
+        name = (window['class'] or '').capitalize()
+    return name
 
-def rename(i3, e):
+async def rename(i3, e):
+    """
+        Worker for window::move / window::close: wait RENAME_DEBOUNCE for the
+        rest of a burst (closing a game or a browser session fires one
+        window::close per window), then run a single rename pass for all of it
+    """
+    await asyncio.sleep(RENAME_DEBOUNCE)
+    reasons = [e.change] + [_[1].change for _ in queues['rename'].drain()]
+    logger.debug(f"Rename pass for {len(reasons)} coalesced events: {reasons}")
+    start = time.perf_counter()
+    try:
+        await rename_workspaces(i3)
+    finally:
+        metrics['handlers']['rename_workspaces'].observe(time.perf_counter() - start)
+
+async def rename_workspaces(i3):
     """
         Rename the workspace so number-addressing still works but the app names
         are provided.
         Uses configured values to nice-ify names, otherwise just capitalize it.
+        All renames are sent to i3 as one ';'-joined command
     """
-    logger.debug(f"Called rename() due to {e.change} trigger")
-    renames = AutoCapitalizeDictionary(settings['app_rename'])
-    # I3 handle iterates over workspaces
-    for i in i3.get_tree().workspaces():
-        # The leaves in a workspace are its containers
-        mergename = " | ".join([renames[_.window_class] for _ in i.leaves()])
-        proposename = "" if mergename == "" else f"{i.num}: {mergename}"
+    commands = list()
+    # Mirror iterates over workspaces
+    for i in await mirror.workspaces(i3):
+        # The windows in a workspace are its containers
+        mergename = " | ".join([display_name(mirror.window(_)) for _ in i['windows']])
+        proposename = "" if mergename == "" else f"{i['num']}: {mergename}"
 
         # No action required
-        if i.name == proposename:
+        if i['name'] == proposename:
             continue
         # Final window exits, revert to just number
         elif proposename == "":
-            if str(i.num) == i.name:
+            if str(i['num']) == i['name']:
                 continue
-            logger.info(f"Rename workspace {i.name} --> {i.num}")
-            status = i3.command(f'rename workspace "{i.name}" to "{i.num}"')
-            if not status[0].success:
-                logger.error(status[0].error)
+            logger.info(f"Rename workspace {i['name']} --> {i['num']}")
+            commands.append(f'rename workspace "{i["name"]}" to "{i["num"]}"')
             continue
         # Use newly formed name
-        logger.info(f"Rename workspace {i.name} --> {proposename}")
-        status = i3.command(f'rename workspace "{i.name}" to "{proposename}"')
-        if not status[0].success:
-            logger.error(status[0].error)
+        logger.info(f"Rename workspace {i['name']} --> {proposename}")
+        commands.append(f'rename workspace "{i["name"]}" to "{proposename}"')
+    if len(commands) == 0:
+        return
+    status = await i3_command(i3, "; ".join(commands))
+    for command, reply in zip(commands, status):
+        if not reply.success:
+            logger.error(f"{command}: {reply.error}")
 
-def tick_listener(i3, e):
+async def tick_listener(i3, e):
     """
         Allows i3-msg to intercept tick messages to produce or alter behaviors
         Format: i3-msg -t send_tick "automanager::<TRIGGER> <VALUE_PAYLOAD>"
 
         Accepted ticks will be placed into the settings['ticks'] dictionary
         and should be unset upon consumption.
+        The 'stats' trigger is handled immediately instead: write the stats
+        file (see dump_stats())
     """
     # Search message to see if it's one that we respond to
     listen_identifier = "automanager::"
@@ -159,11 +632,124 @@ def tick_listener(i3, e):
     else:
         trigger = trim_payload
         value = None
+    if trigger == 'stats':
+        dump_stats()
+        return
     settings['ticks'][trigger] = value
     logger.info(f"Tick registered for trigger '{trigger}' with value '{value}'")
 
+def collect_stats():
+    return {'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'uptime_s': round(time.time() - started),
+            'handlers': dict((name, _.summary()) for name, _ in metrics['handlers'].items()),
+            'ipc': dict((name, _.summary()) for name, _ in metrics['ipc'].items()),
+            'lag': dict((name, _.summary()) for name, _ in metrics['lag'].items()),
+            'queues': dict((name, _.stats) for name, _ in queues.items()),
+            'placements': placements.stats,
+            }
+
+def dump_stats():
+    """
+        Write collect_stats() to stats_path as one line of compact JSON
+        eg: jq . ~/.config/i3/logs/${USER}_automanager_stats.json
+    """
+    stats = collect_stats()
+    tmp_path = stats_path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(stats, f, separators=(',', ':'))
+        f.write('\n')
+    os.replace(tmp_path, stats_path)
+    ipc_summary = ", ".join(f"{name} x{_['n']}" for name, _ in stats['ipc'].items())
+    logger.info(f"Wrote stats to '{stats_path}' (IPC round trips: {ipc_summary})")
+
+async def dump_stats_periodically():
+    while True:
+        await asyncio.sleep(STATS_DUMP_INTERVAL)
+        try:
+            dump_stats()
+        except OSError as e:
+            logger.error(f"Failed to write stats to '{stats_path}': {e}")
+
+def load_settings(config_path):
+    """
+        Read and validate the settings file
+        Raises OSError / ValueError (including JSON errors) when unusable
+    """
+    with open(config_path,"r") as f:
+        loaded = json.load(f)
+    for key in SETTINGS_KEYS:
+        if not isinstance(loaded.get(key), dict):
+            raise ValueError(f"'{key}' must be an object mapping rules to values")
+    return loaded
+
+def reload_settings(config_path):
+    """
+        Re-read settings after the file changed on disk; keep the current
+        settings if the new file is invalid or none of SETTINGS_KEYS changed
+    """
+    global settings, rules
+    try:
+        loaded = load_settings(config_path)
+    except Exception as e:
+        logger.error(f"Keep current settings, failed to reload '{config_path}' ({type(e)}): {e}")
+        return
+    if all(loaded[key] == settings[key] for key in SETTINGS_KEYS):
+        logger.debug(f"'{config_path}' changed outside of {SETTINGS_KEYS}, skip reload")
+        return
+    compiled = compile_rules(loaded)
+    # Tick overrides are runtime state, carry them over
+    loaded['ticks'] = settings['ticks']
+    # Handlers only read these between awaits, so swapping both here is atomic for them
+    settings, rules = loaded, compiled
+    logger.info(f"Settings reloaded: {settings}")
+
+def watch_settings(config_path):
+    """
+        Reload settings whenever config_path is rewritten in place or replaced
+        (inotify on its directory, read from the event loop)
+        Returns the inotify fd, or None if inotify is unavailable
+    """
+    config_path = config_path.resolve()
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        logger.warning(f"inotify unavailable ({os.strerror(ctypes.get_errno())}), settings will not hot-reload")
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(config_path.parent), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        logger.warning(f"Cannot watch '{config_path.parent}' ({os.strerror(ctypes.get_errno())}), settings will not hot-reload")
+        os.close(fd)
+        return None
+    loop = asyncio.get_running_loop()
+    config_name = os.fsencode(config_path.name)
+    pending = None
+
+    def on_readable():
+        nonlocal pending
+        try:
+            data = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        changed = False
+        offset = 0
+        # struct inotify_event { int wd; uint32_t mask, cookie, len; char name[len]; }
+        while offset < len(data):
+            _, mask, _, length = struct.unpack_from('iIII', data, offset)
+            name = data[offset+16 : offset+16+length].rstrip(b'\0')
+            offset += 16 + length
+            if name == config_name:
+                changed = True
+        # Editors may write several times in a row; reload once they settle
+        if changed:
+            if pending is not None:
+                pending.cancel()
+            pending = loop.call_later(SETTINGS_RELOAD_DELAY, reload_settings, config_path)
+
+    loop.add_reader(fd, on_readable)
+    logger.info(f"Watching '{config_path}' for settings changes")
+    return fd
+
 def main():
-    global settings
+    global settings, rules, stats_path
 
     base_path = pathlib.Path(os.getenv('HOME')) / '.config' / 'i3'
     logging.basicConfig(filename=base_path / "logs" / f"{os.environ['USER']}_automanager.log",
@@ -171,21 +757,54 @@ def main():
                         format="%(asctime)s %(levelname)s: %(message)s",
                         datefmt='%Y-%m-%d %H:%M:%S')
     config_path = base_path / f"{os.environ['USER']}_settings.json"
+    stats_path = base_path / "logs" / f"{os.environ['USER']}_automanager_stats.json"
     logger.info(f"Fetch configuration from '{config_path}'")
-    with open(config_path,"r") as f:
-        settings = json.load(f)
+    settings = load_settings(config_path)
     # Inject tick-based overrides -- non-writable portion of JSON
     settings['ticks'] = dict()
     logger.info(f"Settings loaded: {settings}")
+    rules = compile_rules(settings)
+
+    asyncio.run(serve(config_path))
+
+async def serve(config_path):
+    # No auto_reconnect: exec_always starts a fresh automanager on every i3
+    # restart, so this one must exit with its connection instead of lingering
+    i3 = await Connection().connect()
+    workers = await attach(i3)
+    workers.append(asyncio.create_task(dump_stats_periodically()))
+    watch_settings(config_path)
+    i3.on("shutdown", lambda i3, e: i3.main_quit())
 
-    # Subscribe to events
-    i3.on("window::new", auto_assign_new_to_workspace)
-    i3.on("window::move", rename)
-    #i3.on("window::title", rename) # DISABLE -- no window titles seem to actually matter for this, maybe related to i3 hangs?
-    i3.on("window::close", rename)
-    i3.on("tick", tick_listener)
+    try:
+        await i3.main()
+    except EOFError:
+        pass
+    logger.info("i3 shut down or closed the connection, exiting")
+
+async def attach(i3):
+    """
+        Seed the tree mirror, start the queue workers and subscribe the
+        handlers to i3's events (i3 may be a stand-in, see replay_automanager.py)
+        Returns the worker tasks
+    """
+    await mirror.sync(i3)
+    queues['window::new'] = EventQueue('window::new', auto_assign_new_to_workspace)
+    queues['rename'] = EventQueue('rename', rename)
+    queues['tick'] = EventQueue('tick', tick_listener)
+    workers = [asyncio.create_task(queue.worker()) for queue in queues.values()]
 
-    i3.main()
+    # Subscribe to events -- the mirror is registered first so queued handlers
+    # see each event already applied to it
+    i3.on("window", timed('mirror.update', mirror.update))
+    i3.on("workspace", timed('mirror.update', mirror.update))
+    i3.on("window::new", queues['window::new'].put)
+    i3.on("window::move", queues['rename'].put)
+    #i3.on("window::title", queues['rename'].put) # DISABLE -- no window titles seem to actually matter for this, maybe related to i3 hangs?
+    i3.on("window::close", placements.forget)
+    i3.on("window::close", queues['rename'].put)
+    i3.on("tick", queues['tick'].put)
+    return workers
 
 
 if __name__ == "__main__":
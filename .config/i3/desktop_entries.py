@@ -0,0 +1,169 @@
+# Shared index of .desktop entries (installed applications)
+# Used by special_dmenu_handler.py (launch applications by Name) and
+# obs-scripting/i3Follow.py (Steam app id -> game name). The index is cached
+# on disk and refreshed incrementally: one stat per directory and per entry
+# file, re-reading only the files that changed since the last refresh.
+#
+# USAGE: python3 desktop_entries.py   (refresh the index and list applications)
+
+# Builtin modules
+import json
+import logging
+import os
+import pathlib
+import re
+import shlex
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+index_path = pathlib.Path(os.getenv('XDG_CACHE_HOME', pathlib.Path(os.getenv('HOME')) / '.cache')) / f"{os.environ['USER']}_desktop_entry_index.json"
+
+# [Desktop Entry] keys kept in the index
+ENTRY_KEYS = ['Type', 'Name', 'Exec', 'Icon', 'Terminal', 'NoDisplay', 'Hidden']
+
+def application_dirs() -> List[pathlib.Path]:
+    # XDG base directory order: earlier directories take precedence
+    data_home = os.getenv('XDG_DATA_HOME') or str(pathlib.Path(os.getenv('HOME')) / '.local' / 'share')
+    data_dirs = os.getenv('XDG_DATA_DIRS') or '/usr/local/share:/usr/share'
+    dirs = [data_home] + [_ for _ in data_dirs.split(os.pathsep) if _ != '']
+    return [pathlib.Path(_) / 'applications' for _ in dict.fromkeys(dirs)]
+
+def parse_desktop_entry(path: pathlib.Path) -> Optional[dict]:
+    """
+        ENTRY_KEYS of the file's [Desktop Entry] group (unlocalized values),
+        or None if it is not an application that can be launched
+    """
+    entry = dict()
+    in_group = False
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('['):
+                if in_group:
+                    break
+                in_group = line == '[Desktop Entry]'
+                continue
+            if not in_group or line.startswith('#') or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            key = key.strip()
+            if key in ENTRY_KEYS:
+                entry[key] = value.strip()
+    if entry.get('Type') != 'Application' or 'Name' not in entry or 'Exec' not in entry:
+        return None
+    # Hidden=true means the entry was deleted (and masks lower precedence ones)
+    return entry
+
+def load_index(path: pathlib.Path = index_path) -> dict:
+    if not path.exists():
+        return {'dirs': {}}
+    try:
+        with open(path, 'r') as f:
+            index = json.load(f)
+        _ = index['dirs']
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable desktop entry index {path} ({type(e)}): {e}")
+        return {'dirs': {}}
+    return index
+
+def save_index(index: dict, path: pathlib.Path = index_path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+def refresh_index(index: dict, roots: List[pathlib.Path]) -> Tuple[Dict[str, dict], bool]:
+    """
+        Bring the in-memory index up to date with the filesystem.
+
+        The index records every directory below each root with its mtime,
+        subdirectories and .desktop files (each with its own mtime and parsed
+        entry). A directory whose mtime is unchanged is not re-listed, and a
+        file whose mtime is unchanged is not re-read.
+
+        Returns (entries, changed) where entries maps each desktop file ID
+        (path below its root, '/' replaced by '-') to its entry plus 'path';
+        the first root providing an ID wins, as the XDG spec asks.
+    """
+    entries = dict()
+    changed = False
+    new_dirs = dict()
+    for root in roots:
+        pending = ['']
+        while len(pending) > 0:
+            reldir = pending.pop()
+            dir_path = root / reldir if reldir != '' else root
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                continue
+            record = index['dirs'].get(str(dir_path))
+            if record is None or record['mtime_ns'] != mtime_ns:
+                old_files = dict() if record is None else record['files']
+                files, subdirs = dict(), list()
+                try:
+                    with os.scandir(dir_path) as it:
+                        for entry in it:
+                            # Symlinked directories could loop back up the tree
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.name)
+                            elif entry.name.endswith('.desktop'):
+                                files[entry.name] = old_files.get(entry.name)
+                except OSError as e:
+                    logger.warning(f"Cannot index directory '{dir_path}': {e}")
+                    continue
+                record = {'mtime_ns': mtime_ns, 'files': files, 'subdirs': subdirs}
+                changed = True
+            for name, file_record in record['files'].items():
+                file_path = dir_path / name
+                try:
+                    file_mtime_ns = os.stat(file_path).st_mtime_ns
+                except OSError:
+                    continue
+                if file_record is None or file_record['mtime_ns'] != file_mtime_ns:
+                    try:
+                        parsed = parse_desktop_entry(file_path)
+                    except OSError as e:
+                        logger.warning(f"Cannot read desktop entry '{file_path}': {e}")
+                        parsed = None
+                    file_record = {'mtime_ns': file_mtime_ns, 'entry': parsed}
+                    record['files'][name] = file_record
+                    changed = True
+                desktop_id = (reldir + '/' + name if reldir != '' else name).replace('/', '-')
+                if desktop_id not in entries:
+                    entries[desktop_id] = None if file_record['entry'] is None else dict(file_record['entry'], path=str(file_path))
+            new_dirs[str(dir_path)] = record
+            prefix = reldir + '/' if reldir != '' else ''
+            pending.extend(prefix + name for name in record['subdirs'])
+    if set(new_dirs) != set(index['dirs']):
+        changed = True
+    index['dirs'] = new_dirs
+    # None kept IDs masked above; drop them (and deleted entries) now
+    return dict((k, v) for k, v in entries.items() if v is not None and v.get('Hidden') != 'true'), changed
+
+def current_entries(index: dict) -> Dict[str, dict]:
+    # Refresh index (in place) and persist it for the next process if anything changed
+    entries, changed = refresh_index(index, application_dirs())
+    if changed:
+        save_index(index)
+    return entries
+
+def exec_argv(entry: dict) -> List[str]:
+    """
+        Exec key as an argument list: %c becomes the Name, %k the entry's path,
+        %% a literal %, and the other field codes (files, URLs, icon) are dropped
+    """
+    codes = {'%': '%', 'c': entry['Name'], 'k': entry.get('path', '')}
+    argv = list()
+    for arg in shlex.split(entry['Exec']):
+        arg = re.sub(r'%(.)', lambda m: codes.get(m.group(1), ''), arg)
+        if arg != '':
+            argv.append(arg)
+    return argv
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+    for desktop_id, entry in sorted(current_entries(load_index()).items()):
+        print(f"{desktop_id}\t{entry['Name']}\t{entry['Exec']}")
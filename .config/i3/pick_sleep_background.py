@@ -1,17 +1,25 @@
 # Dependent modules
 import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont, ImageOps
 
 # Builtin modules
 import argparse
+import concurrent.futures
 import datetime
+import fcntl
+import fnmatch
+import functools
+import hashlib
 import itertools
 import json
 import logging
 import os
 import pathlib
+import re
+import socket
+import socketserver
 import subprocess
 import sys
-import time
 
 from collections import OrderedDict
 
@@ -21,7 +29,27 @@ default_config_path = default_base_path / f"{os.environ['USER']}_sleep_history.j
 
 # i3lock only supports PNGs
 SUPPORTED_FILETYPES = ['.png']
+# Other formats join the library once the background job has converted them to PNG
+CONVERTIBLE_FILETYPES = ['.jpg', '.jpeg', '.webp', '.bmp', '.gif', '.tif', '.tiff']
+LIBRARY_FILETYPES = SUPPORTED_FILETYPES + CONVERTIBLE_FILETYPES
 DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Overlay cache is trimmed to this many bytes unless the history sets cache_budget
+DEFAULT_CACHE_BUDGET = 256 * 1024 * 1024
+# Eviction order used when trimming the cache: 'lru' (oldest last-access first)
+# or 'lfu' (fewest access-count first, ties broken by oldest last-access)
+CACHE_EVICTION_POLICIES = ['lru', 'lfu']
+# Per-directory listing of all library roots kept in cache_path so unchanged
+# directories are not rescanned
+LIBRARY_INDEX_NAME = "library_index.json"
+# Once the selection log grows past this many bytes, a lock asks the background
+# job to compact it into the history JSON
+WAL_COMPACT_BYTES = 16 * 1024
+# Converted copies of non-PNG library images (named by content fingerprint) and
+# the record mapping every library image to its fingerprint, both kept in cache_path
+CONVERSION_DIR_NAME = "converted"
+FINGERPRINT_RECORD_NAME = "fingerprints.json"
+# Number of highest-weighted images that get screen-sized variants rendered ahead of time
+DEFAULT_PRERENDER_COUNT = 4
 
 # IMPORTANT: If errors occur, log them, but do not stdout anything.
 # The white default lock screen is a signal to the user that an error occurred
@@ -61,21 +89,28 @@ def init_history(configpath):
             "frequency-weight-multiplier": 1, # Increases weight attribution based on access-frequency
             "new-image-weight-advantage": 1, # Increases weight for NEVER picked images
             "cache_path": "~/.cache/sleep_backgrounds", # Where edited images get cached
-            "base_path": "~/Pictures/Desktop Backgrounds", # Where images are located on disk (single directory to search)
+            "cache_budget": DEFAULT_CACHE_BUDGET, # Maximum bytes of cached images kept in cache_path
+            "cache_eviction": "lru", # Which cached images to evict first when over budget (lru/lfu)
+            "prerender_count": DEFAULT_PRERENDER_COUNT, # Top-weighted images to pre-scale to the screen layout in the background
+            "base_path": "~/Pictures/Desktop Backgrounds", # Where images are located on disk (searched recursively)
+            "library_roots": [], # Additional directories to search recursively for images
             "images": {}, # Stores metadata about historically sampled images
                           # FORMAT:
-                          #   Key = filename relative to base_path
+                          #   Key = path relative to base_path (or '<library_root>/<relative path>' for other roots)
                           #   Values:
                           #     last-access: YYYY-MM-DD HH:MM:SS (date of last sampling selection)
                           #     penalty-weight: 0 (manual adjustment to sampling frequency)
                           #     omit: false (manually deny image from being sampled)
+                          #     access-count: 1 (number of times the image has been selected)
                           #     overlay_maps: dict of 'overlay_string' -> 'new filepath' where the overlay is applied
+                          #                   'overlay_string@geometry' entries are pre-scaled to that screen layout
             "overlay_sizes": {}, # Maps strings to the f"{x},{y}" size string needed
                                  # to print the string as an overlay on an image
             }
     logger.info(f"Initialize NEW history at {configpath}")
-    with open(configpath,'w') as f:
-        json.dump(default, f)
+    write_history_atomically(default, configpath)
+    # Events logged against the old history do not apply to the new one
+    wal_path_for(configpath).unlink(missing_ok=True)
     return default
 
 def load_history(expect_history):
@@ -100,6 +135,11 @@ def load_history(expect_history):
                            "cache_path": _history["cache_path"],
                            "base_path": _history["base_path"],
                            "overlay_sizes": _history["overlay_sizes"],
+                           # Optional keys (added after the original format) use defaults
+                           "cache_budget": _history.get("cache_budget", DEFAULT_CACHE_BUDGET),
+                           "cache_eviction": _history.get("cache_eviction", "lru"),
+                           "library_roots": _history.get("library_roots", []),
+                           "prerender_count": _history.get("prerender_count", DEFAULT_PRERENDER_COUNT),
                            }
             except KeyError as e:
                 logger.error(f"History / configuration file does not have required key '{e.args[0]}'. It may be misformatted.")
@@ -121,14 +161,270 @@ def load_history(expect_history):
                 history['images'][key]['last-access'] = dt_value
             # Finished processing from JSON, free the memory
             del _history
+        # Fold in selections / renders logged since the JSON was last compacted
+        wal_offsets[str(expect_history)] = 0
+        replay_history_events(history, expect_history)
     return history
 
-def set_weights(history, base_path):
+def resolve_index_targets(targets, image_paths, base_path):
+    """
+        Expand --index arguments into image keys, in the order given:
+            an image key, or a file path (absolute or relative to base_path)
+            a directory: every indexed image below it
+            a glob: every image key or path it matches
+        Raises FileNotFoundError for arguments that match nothing
+    """
+    by_path = dict((str(path), key) for key, path in image_paths.items())
+    keys = list()
+    for target in targets:
+        if target in image_paths:
+            keys.append(target)
+            continue
+        target_path = base_path / pathlib.Path(target).expanduser()
+        if str(target_path) in by_path:
+            keys.append(by_path[str(target_path)])
+            continue
+        if target_path.is_dir():
+            prefix = str(target_path).rstrip('/') + '/'
+            matches = sorted(key for path, key in by_path.items() if path.startswith(prefix))
+        else:
+            matches = sorted(key for key, path in image_paths.items()
+                             if fnmatch.fnmatchcase(key, target) or fnmatch.fnmatchcase(str(path), str(target_path)))
+        if len(matches) == 0:
+            raise FileNotFoundError(f"Could not locate any indexed image for '{target}' (relative to {base_path})")
+        keys.extend(matches)
+    # Images named twice keep their first position
+    return list(dict.fromkeys(keys))
+
+def bulk_index(history, keys):
+    """
+        Initialize / touch history entries for keys in one pass. Rather than
+        waiting between images, last-access is assigned strictly increasing
+        synthetic timestamps one second apart (the stored precision) ending
+        now, so keys[0] is treated as least-recently and keys[-1] as most
+        recently accessed.
+    """
+    end = now()
+    for order, key in enumerate(keys):
+        timestamp = end - datetime.timedelta(seconds=len(keys)-1-order)
+        if key not in history['images']:
+            history['images'][key] = new_history_for_image()
+        history['images'][key]['last-access'] = timestamp
+    logger.info(f"Indexed {len(keys)} images with last-access from {end - datetime.timedelta(seconds=max(len(keys)-1, 0))} to {end}")
+
+# WRITE-AHEAD LOG
+# Locks never rewrite the history JSON. Each lock appends one line of events
+# to <config>.wal with a single fsync; load_history() replays them and
+# save_history() folds them into the JSON (atomically) and truncates the log.
+# Event formats:
+#   {"event": "select", "key": <image key>, "time": <DATETIME_FORMAT>}
+#   {"event": "render", "key": <image key>, "map": <overlay_maps key>, "path": <cached file>,
+#    "text": <overlay text or null>, "size": <overlay size or null>}
+# Bytes of each config's log already reflected in the history held in memory
+wal_offsets = dict()
+
+def wal_path_for(config):
+    return pathlib.Path(config).with_suffix('.wal')
+
+def apply_history_event(history, event):
+    key = event['key']
+    if event['event'] == 'select':
+        timestamp = datetime.datetime.strptime(event['time'], DATETIME_FORMAT)
+        if key not in history['images']:
+            history['images'][key] = new_history_for_image()
+            history['images'][key]['last-access'] = timestamp
+        else:
+            history['images'][key]['last-access'] = timestamp
+            history['images'][key]['access-count'] = history['images'][key].get('access-count', 0) + 1
+    elif event['event'] == 'render':
+        if event['text'] is not None and event['size'] is not None:
+            history['overlay_sizes'][event['text']] = event['size']
+        if key in history['images']:
+            history['images'][key]['overlay_maps'][event['map']] = event['path']
+    else:
+        raise ValueError(f"Unknown event type '{event['event']}'")
+
+def replay_history_events(history, config, wal=None):
+    """
+        Apply logged events past the known offset for config onto history.
+        Pass an already-open (and locked) wal handle to read under that lock
+    """
+    wal_path = wal_path_for(config)
+    # Events are pure ASCII (json.dumps default), so characters == bytes for offsets
+    if wal is None:
+        if not wal_path.exists():
+            wal_offsets[str(config)] = 0
+            return
+        with open(wal_path, 'r') as f:
+            return replay_history_events(history, config, f)
+    offset = wal_offsets.get(str(config), 0)
+    # Someone else compacted the log since we last read it
+    if offset > os.fstat(wal.fileno()).st_size:
+        offset = 0
+    wal.seek(offset)
+    replayed = 0
+    while (line := wal.readline()) != '':
+        # A crash mid-append can only leave a partial final line
+        if not line.endswith('\n'):
+            logger.warning(f"Ignoring incomplete trailing event in {wal_path}: {line}")
+            break
+        offset += len(line)
+        try:
+            apply_history_event(history, json.loads(line))
+        except Exception as e:
+            logger.warning(f"Ignoring malformed event in {wal_path} ({type(e)}): {line.rstrip()}")
+        replayed += 1
+    wal_offsets[str(config)] = offset
+    if replayed > 0:
+        logger.info(f"Replayed {replayed} logged events from {wal_path}")
+
+def append_history_events(config, events):
+    """
+        Durably log events with one write and one fsync.
+        Returns the size of the log afterwards (to decide on compaction)
+    """
+    wal_path = wal_path_for(config)
+    payload = ''.join(json.dumps(event, separators=(',', ':'))+'\n' for event in events)
+    with open(wal_path, 'a+') as wal:
+        fcntl.flock(wal, fcntl.LOCK_EX)
+        start = wal.seek(0, os.SEEK_END)
+        # Terminate a partial line left by a crash so it can't swallow ours
+        if start > 0:
+            wal.seek(start - 1)
+            if wal.read(1) != '\n':
+                payload = '\n' + payload
+        wal.write(payload)
+        wal.flush()
+        os.fsync(wal.fileno())
+        # Our own events are already in memory; only skip past them if nothing
+        # from another process was pending before them
+        if wal_offsets.get(str(config), 0) == start:
+            wal_offsets[str(config)] = wal.tell()
+        size = wal.tell()
+    logger.info(f"Logged {len(events)} events to {wal_path}")
+    logger.debug(events)
+    return size
+
+def library_roots(history):
+    """
+        Configured image roots as (root_string, expanded_path) pairs.
+        base_path is always the first root; library_roots lists any others.
+    """
+    roots = [history['base_path']] + list(history['library_roots'])
+    return [(root.rstrip('/'), pathlib.Path(root).expanduser()) for root in roots]
+
+def key_for(root_idx, root, relpath):
+    # Images under base_path keep keys relative to it (flat libraries keep bare
+    # filenames); images under other roots are prefixed by their root as written
+    return relpath if root_idx == 0 else f"{root}/{relpath}"
+
+def load_library_index(index_path):
+    if index_path is None or not index_path.exists():
+        return {'roots': {}}
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        _ = index['roots']
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable library index {index_path} ({type(e)}): {e}")
+        return {'roots': {}}
+    return index
+
+def save_library_index(index, index_path):
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = index_path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(tmp_path, index_path)
+
+def refresh_library_index(index, roots):
+    """
+        Bring the in-memory library index up to date with the filesystem.
+
+        The index records every directory below each root with its mtime,
+        supported files, skipped files and subdirectories. A directory whose
+        mtime is unchanged is trusted without listing it, so a refresh costs
+        one stat per directory; changed directories are re-listed with
+        os.scandir and diffed so only additions/removals get logged.
+
+        Returns (image_paths, changed) where image_paths maps every image key
+        to its absolute path.
+    """
+    image_paths = dict()
+    changed = False
+    new_roots = dict()
+    for root_idx, (root, root_path) in enumerate(roots):
+        old_dirs = index['roots'].get(root, {})
+        new_dirs = dict()
+        pending = ['']
+        while len(pending) > 0:
+            reldir = pending.pop()
+            dir_path = root_path / reldir if reldir != '' else root_path
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except OSError as e:
+                logger.warning(f"Cannot index directory '{dir_path}': {e}")
+                continue
+            record = old_dirs.get(reldir)
+            if record is None or record['mtime_ns'] != mtime_ns:
+                files, skipped, subdirs = list(), list(), list()
+                with os.scandir(dir_path) as it:
+                    for entry in it:
+                        if entry.name.startswith('.'):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif not entry.is_file():
+                            continue
+                        elif os.path.splitext(entry.name)[1].lower() in LIBRARY_FILETYPES:
+                            files.append(entry.name)
+                        else:
+                            skipped.append(entry.name)
+                old_files = set() if record is None else set(record['files'])
+                old_skipped = set() if record is None else set(record['skipped'])
+                for name in set(skipped).difference(old_skipped):
+                    logger.info(f"Not including file '{dir_path / name}': FileType '{os.path.splitext(name)[1]}' not supported")
+                for name in set(files).difference(old_files):
+                    logger.info(f"Found new file '{dir_path / name}'")
+                for name in old_files.difference(files):
+                    logger.info(f"File '{dir_path / name}' no longer present")
+                record = {'mtime_ns': mtime_ns, 'files': files, 'skipped': skipped, 'subdirs': subdirs}
+                changed = True
+            new_dirs[reldir] = record
+            prefix = reldir + '/' if reldir != '' else ''
+            for name in record['files']:
+                key = key_for(root_idx, root, prefix + name)
+                if key in image_paths:
+                    logger.warning(f"Image key '{key}' found in multiple roots, keeping '{image_paths[key]}'")
+                    continue
+                image_paths[key] = dir_path / name
+            pending.extend(prefix + name for name in record['subdirs'])
+        # Directories that vanished (or roots no longer configured) drop out
+        if len(new_dirs) != len(old_dirs):
+            changed = True
+        new_roots[root] = new_dirs
+    if len(new_roots) != len(index['roots']):
+        changed = True
+    index['roots'] = new_roots
+    return image_paths, changed
+
+def scan_library(history, index_path=None):
+    """
+        One-shot wrapper: load the persisted index, refresh it against the
+        configured roots and save it back only if anything changed
+    """
+    index = load_library_index(index_path)
+    image_paths, changed = refresh_library_index(index, library_roots(history))
+    if changed and index_path is not None:
+        save_library_index(index, index_path)
+    return image_paths
+
+def set_weights(history, image_paths):
     keyweights = dict()
     remove_keys = []
-    # Index filesystem to validate keys
+    # Validate keys against the library index (key -> absolute path)
     for key, value in history['images'].items():
-        if (base_path / key).exists():
+        if key in image_paths:
             weight_adjust = history['penalty-weight-multiplier'] * value['penalty-weight']
             if weight_adjust != 0:
                 logger.debug(f"Adjusted base weight for '{key}': {weight_adjust}")
@@ -140,24 +436,19 @@ def set_weights(history, base_path):
     for key in remove_keys:
         del history['images'][key]
 
-    # Filter any hard omits out
-    for key, value in history['images'].items():
-        if value['omit'] and key in hist_sort:
-            logger.info(f"Omit key '{key}' due to hard-omit flag")
-            del hist_sort[key]
+    # Filter any hard omits out (they still need weights to rank last-access below)
+    omit_keys = set(key for key, value in history['images'].items() if value['omit'])
+    # Images awaiting PNG conversion stay in history but cannot be picked yet
+    pending_keys = set(key for key, path in image_paths.items() if path is None)
 
     # Add any new keys
     original_keyweight_len = len(keyweights)
     added_keys = list()
-    for file_path in base_path.iterdir():
-        if file_path.suffix.lower() not in SUPPORTED_FILETYPES:
-            logger.info(f"Not including file '{file_path}': FileType '{file_path.suffix}' not supported")
-            continue
+    for key in image_paths:
         # Already present file
-        if file_path.name in keyweights:
+        if key in keyweights:
             continue
         # NEW file is given weight == OLDEST + new-image-weight-advantage
-        key = file_path.name
         new_weight = history['new-image-weight-advantage']
         logger.debug(f"Initialize NEW image '{key}' with weight {new_weight}")
         keyweights[key] = new_weight
@@ -214,6 +505,12 @@ def set_weights(history, base_path):
     weightsort = np.argsort(inv_wkeys)
     for value_idx in reversed(weightsort):
         value = inv_wkeys[value_idx]
+        if inv_kkeys[value_idx] in omit_keys:
+            logger.info(f"Omit key '{inv_kkeys[value_idx]}' due to hard-omit flag")
+            continue
+        if inv_kkeys[value_idx] in pending_keys:
+            logger.info(f"Skip key '{inv_kkeys[value_idx]}' until its PNG conversion is ready")
+            continue
         # Really negative values should not be pickable
         if value < 0:
             logger.info(f"Drop key {inv_kkeys[value_idx]} for negative weight: {value}")
@@ -223,30 +520,103 @@ def set_weights(history, base_path):
 
     return history, hist_sort
 
+def now():
+    # Stored timestamps only have second precision, keep in-memory ones comparable
+    return datetime.datetime.now().replace(microsecond=0)
+
 def new_history_for_image():
     return {
-            "last-access": datetime.datetime.now().strftime(DATETIME_FORMAT),
+            "last-access": now(),
             "penalty-weight": 0,
             "omit": False,
+            "access-count": 1,
             "overlay_maps": {},
             }
 
-def update_last_access(history, selected_key, config):
-    # Ensure JSON-serializability
-    for image in history['images']:
-        history['images'][image]['last-access'] = history['images'][image]['last-access'].strftime(DATETIME_FORMAT)
-    # Update last-access
+def write_history_atomically(history, config):
+    # Write aside and rename over so a crash never leaves a truncated history
+    tmp_path = pathlib.Path(config).with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        # last-access values are datetimes; serialize them in the stored format
+        json.dump(history, f, default=lambda dt: dt.strftime(DATETIME_FORMAT))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, config)
+
+def loaded_overlay_maps(history):
+    # Snapshot for save_history(): which images (and renders) a job started from
+    return dict((key, dict(value['overlay_maps'])) for key, value in history['images'].items())
+
+def merge_job_changes(current, history, loaded_maps):
+    """
+        Apply onto current (the history as it is on disk now) only what a job
+        changed in history since loaded_maps was taken: images it dropped and
+        overlay_maps entries it added, replaced or removed. Everything else
+        (CLI edits, selections compacted by others) is kept from current
+    """
+    for key in set(loaded_maps).difference(history['images']):
+        if current['images'].pop(key, None) is not None:
+            logger.info(f"Merge: drop image '{key}'")
+    for key, value in history['images'].items():
+        if key not in current['images']:
+            continue
+        before = loaded_maps.get(key, dict())
+        maps = current['images'][key]['overlay_maps']
+        for map_key, overlay_path in value['overlay_maps'].items():
+            if before.get(map_key) != overlay_path:
+                maps[map_key] = overlay_path
+        for map_key, overlay_path in before.items():
+            if map_key not in value['overlay_maps'] and maps.get(map_key) == overlay_path:
+                del maps[map_key]
+    for text, size in history['overlay_sizes'].items():
+        current['overlay_sizes'].setdefault(text, size)
+    return current
+
+def save_history(history, config, loaded_maps=None):
+    """
+        Compact: fold any events other processes logged since history was
+        loaded into it, replace the JSON atomically and truncate the log.
+        Long-running jobs pass loaded_maps (see loaded_overlay_maps()) to have
+        the config re-read under the lock and only their own changes merged
+        in, so edits and compactions made while they ran are not reverted.
+        Returns the history written
+    """
+    with open(wal_path_for(config), 'a+') as wal:
+        fcntl.flock(wal, fcntl.LOCK_EX)
+        if loaded_maps is not None:
+            # load_history() replays the whole (locked) log on top of the JSON
+            history = merge_job_changes(load_history(config), history, loaded_maps)
+        else:
+            replay_history_events(history, config, wal)
+        logger.info(f"Update config {config} with latest selection and metadata")
+        logger.debug(history)
+        write_history_atomically(history, config)
+        wal.truncate(0)
+        wal_offsets[str(config)] = 0
+    return history
+
+def update_last_access(history, selected_key, timestamp=None):
+    # last-access stays a datetime in memory (save_history serializes it) so
+    # a resident process can keep re-weighting the same history
+    # timestamp defaults to now() (simulations pass their own clock)
+    # Returns the event to log for this selection
+    if timestamp is None:
+        timestamp = now()
     if selected_key not in history['images']:
         history['images'][selected_key] = new_history_for_image()
+        history['images'][selected_key]['last-access'] = timestamp
     else:
-        history['images'][selected_key]['last-access'] = datetime.datetime.now().strftime(DATETIME_FORMAT)
-    with open(config, 'w') as f:
-        logger.info(f"Update config {config} with latest selection and metadata")
-        logger.debug(history)
-        json.dump(history, f)
+        history['images'][selected_key]['last-access'] = timestamp
+        history['images'][selected_key]['access-count'] = history['images'][selected_key].get('access-count', 0) + 1
+    return {'event': 'select',
+            'key': selected_key,
+            'time': history['images'][selected_key]['last-access'].strftime(DATETIME_FORMAT),
+            }
 
-def make_weighted_choice(hist_sort):
-    rng = np.random.default_rng()
+def make_weighted_choice(hist_sort, rng=None):
+    # rng defaults to a freshly seeded generator (simulations pass a seeded one)
+    if rng is None:
+        rng = np.random.default_rng()
     weightsum = sum(hist_sort.values())
     logger.info(f"Available keys and weights for selection: {hist_sort} (Sum weight: {weightsum})")
     init_choice = choice = rng.integers(0,weightsum)
@@ -264,29 +634,683 @@ def make_weighted_choice(hist_sort):
 OVERLAY_FONT = "/usr/share/fonts/truetype/UbuntuMono/UbuntuMonoNerdFontMono-Bold.ttf"
 OVERLAY_SIZE = 72
 OVERLAY_BORDER = "10x10"
+# Backdrop drawn behind the overlay text: rgba(0,0,0,0.6) with 10px rounded corners, blurred with sigma 3
+OVERLAY_BACKDROP_FILL = (0, 0, 0, 153)
+OVERLAY_BACKDROP_RADIUS = 10
+OVERLAY_BACKDROP_BLUR = 3
+OVERLAY_TEXT_FILL = (255, 255, 255, 255)
+
+@functools.lru_cache(maxsize=None)
+def load_overlay_font():
+    # FreeType face is loaded once per process and re-used for measuring and drawing
+    return ImageFont.truetype(OVERLAY_FONT, OVERLAY_SIZE)
+
 def calculate_overlay_size(text: str):
     # For simplicity, the font config and border settings are in THIS script (above)
     # and not currently exposed to the user, as it would require me to somehow
     # save and compare if a cached overlay image respects the intended settings.
     # Set your overlay parameters ONCE and invalidate all of your cached images
     # if you decide to change it
-
-    # Make a temp file and then unlink it -- clobbering not expected; not protected
-    tmp_file = pathlib.Path('/tmp/overlay_measure.png')
-    # Split the command up a bit so it doesn't get ruined formatting-wise
-    cmd_pt1 = (f"convert -background none -fill white -font {OVERLAY_FONT} "+\
-              f"-pointsize {OVERLAY_SIZE}").split()
-    cmd_pt2 = [f"label:{text}"]
-    cmd_pt3 = (f"-trim +repage -bordercolor none -border {OVERLAY_BORDER} "+\
-              f"{tmp_file}").split()
     logger.info(f"Calculate overlay size for string '{text}'")
-    subprocess.run(cmd_pt1+cmd_pt2+cmd_pt3)
-    measurement_result = subprocess.run(f"identify {tmp_file}".split(),
-                                        stdout=subprocess.PIPE,
-                                        ).stdout
-    tmp_file.unlink()
-    # <IMG_NAME> <IMG_FORMAT> <IMG_SIZE_XxY> ...
-    return measurement_result.decode('utf-8').split()[2].replace('x',',')
+    # Equivalent of ImageMagick's label + -trim: the inked bounding box of the text
+    left, top, right, bottom = load_overlay_font().getbbox(text)
+    # Equivalent of -border WxH: padding on both sides of each dimension
+    border_x, border_y = map(int, OVERLAY_BORDER.split('x'))
+    return f"{(right-left)+2*border_x},{(bottom-top)+2*border_y}"
+
+def composite_overlay(image, text, overlay_size, center):
+    # Draw the overlay (backdrop + text) onto RGBA image in-place, centered at center
+    width, height = map(int, overlay_size.split(','))
+    font = load_overlay_font()
+    # Backdrop is drawn on a transparent layer so the blur feathers its edges
+    backdrop = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    ImageDraw.Draw(backdrop).rounded_rectangle((0, 0, width-1, height-1),
+                                               radius=OVERLAY_BACKDROP_RADIUS,
+                                               fill=OVERLAY_BACKDROP_FILL)
+    backdrop = backdrop.filter(ImageFilter.GaussianBlur(OVERLAY_BACKDROP_BLUR))
+    image.alpha_composite(backdrop, (center[0] - width // 2, center[1] - height // 2))
+    # Center the inked extent of the text (not its line box) within the backdrop
+    left, top, right, bottom = font.getbbox(text)
+    origin = (center[0] - (left + right) // 2, center[1] - (top + bottom) // 2)
+    ImageDraw.Draw(image).text(origin, text, font=font, fill=OVERLAY_TEXT_FILL)
+
+def render_overlay(source_path, text, overlay_size, overlay_path):
+    """
+        Composite the text overlay onto the image at source_path and save it
+        to overlay_path. Reproduces the former ImageMagick pipeline:
+            blurred rounded-rectangle backdrop centered on the image
+            text annotated in white over the center of the backdrop
+        Returns True on success, False (with error logged) otherwise
+    """
+    try:
+        with Image.open(source_path) as source:
+            keep_alpha = 'A' in source.getbands()
+            image = source.convert('RGBA')
+        composite_overlay(image, text, overlay_size, (image.width // 2, image.height // 2))
+        if not keep_alpha:
+            image = image.convert('RGB')
+        image.save(overlay_path, format='PNG')
+    except Exception as e:
+        logger.error(f"Failed to render overlay for '{source_path}' ({type(e)}): {e}")
+        return False
+    return True
+
+
+# FORMAT CONVERSION
+def content_fingerprint(path):
+    # Identifies image content regardless of its name or location
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_fingerprints(cache_path):
+    # {image path: {"size": bytes, "mtime_ns": int, "ino": int, "fingerprint": hex}}
+    # "fingerprint" is None for files that failed to hash / convert
+    record_path = cache_path / FINGERPRINT_RECORD_NAME
+    if not record_path.exists():
+        return dict()
+    try:
+        with open(record_path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable fingerprint record {record_path} ({type(e)}): {e}")
+        return dict()
+
+def converted_path(cache_path, fingerprint):
+    return cache_path / CONVERSION_DIR_NAME / f"{fingerprint}.png"
+
+def failed_unchanged(path, entry):
+    # A failed conversion is retried only once the file changes
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return True
+    return (entry['ino'], entry['size'], entry['mtime_ns']) == (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def selectable_paths(image_paths, cache_path, fingerprints):
+    """
+        Map library keys to the PNG i3lock can show: PNGs as-is, other
+        formats to their converted copy, or None while they cannot be shown.
+        Uses only the fingerprint record (no per-file stat at lock time, save
+        for files whose conversion failed).
+        Returns (selectable, pending) where pending holds the keys still
+        waiting for the background job (recorded failures are not pending)
+    """
+    selectable = dict()
+    pending = set()
+    for key, path in image_paths.items():
+        entry = fingerprints.get(str(path))
+        if path.suffix.lower() in SUPPORTED_FILETYPES:
+            selectable[key] = path
+        elif entry is not None and entry['fingerprint'] is not None:
+            selectable[key] = converted_path(cache_path, entry['fingerprint'])
+        else:
+            selectable[key] = None
+            if entry is None or not failed_unchanged(path, entry):
+                pending.add(key)
+    return selectable, pending
+
+def lookup_fingerprint(path, fingerprints, cache_path, compute=True):
+    """
+        Content fingerprint of a selectable image, cheapest source first:
+            converted copies are named by their source's fingerprint
+            the background job's record (trusted as-is)
+            a record for the same inode/size/mtime (the file was renamed or moved)
+            hashing the file now
+        The last two are skipped (returning None) unless compute is set
+    """
+    path = pathlib.Path(path)
+    if path.parent == cache_path / CONVERSION_DIR_NAME:
+        return path.stem
+    if fingerprints.get(str(path), dict()).get('fingerprint') is not None:
+        return fingerprints[str(path)]['fingerprint']
+    if not compute:
+        return None
+    stat = os.stat(path)
+    for entry in fingerprints.values():
+        if entry['fingerprint'] is not None \
+                and (entry['ino'], entry['size'], entry['mtime_ns']) == (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+            return entry['fingerprint']
+    logger.info(f"No recorded fingerprint for '{path}', hashing it now")
+    return content_fingerprint(path)
+
+def fingerprint_image(source_path, output_dir):
+    """
+        Process-pool worker: fingerprint source_path and, unless it is a PNG,
+        write its PNG copy into output_dir unless that content was already
+        converted.
+        Returns (source_path, fingerprint) or (source_path, None) on failure
+    """
+    try:
+        fingerprint = content_fingerprint(source_path)
+        if pathlib.Path(source_path).suffix.lower() in SUPPORTED_FILETYPES:
+            return source_path, fingerprint
+        output_path = pathlib.Path(output_dir) / f"{fingerprint}.png"
+        if not output_path.exists():
+            with Image.open(source_path) as source:
+                # First frame only for animated formats; keep transparency if present
+                image = source.convert('RGBA' if 'A' in source.getbands() or 'transparency' in source.info else 'RGB')
+            tmp_path = output_path.with_suffix('.tmp')
+            image.save(tmp_path, format='PNG')
+            os.replace(tmp_path, output_path)
+        return source_path, fingerprint
+    except Exception as e:
+        logger.error(f"Failed to fingerprint / convert '{source_path}' ({type(e)}): {e}")
+        return source_path, None
+
+def fingerprint_library(history, image_paths):
+    """
+        Bring the fingerprint record and converted PNG copies up to date with
+        the library. New/changed images are hashed (and non-PNGs converted)
+        in a process pool; renamed/moved files reuse the fingerprint recorded
+        for the same inode, size and mtime. Failures are recorded (fingerprint
+        None) and not retried until the file changes. Copies whose source
+        content left the library are removed.
+        Returns True if the fingerprint record changed
+    """
+    cache_path = pathlib.Path(history['cache_path']).expanduser()
+    output_dir = cache_path / CONVERSION_DIR_NAME
+    output_dir.mkdir(parents=True, exist_ok=True)
+    fingerprints = load_fingerprints(cache_path)
+    by_inode = dict(((_['ino'], _['size'], _['mtime_ns']), _) for _ in fingerprints.values())
+    record = dict()
+    pending = list()
+    for key, path in image_paths.items():
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            logger.warning(f"Cannot fingerprint '{path}': {e}")
+            continue
+        needs_copy = path.suffix.lower() not in SUPPORTED_FILETYPES
+        old = fingerprints.get(str(path))
+        if old is None or (old['ino'], old['size'], old['mtime_ns']) != (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+            old = by_inode.get((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        if old is not None and (old['fingerprint'] is None or not needs_copy
+                                or converted_path(cache_path, old['fingerprint']).exists()):
+            record[str(path)] = dict(old)
+            continue
+        pending.append((str(path), stat))
+    if len(pending) > 0:
+        logger.info(f"Fingerprinting {len(pending)} images (converting non-PNGs into {output_dir})")
+        stats = dict(pending)
+        with concurrent.futures.ProcessPoolExecutor() as pool:
+            futures = [pool.submit(fingerprint_image, path, str(output_dir)) for path, _ in pending]
+            for future in concurrent.futures.as_completed(futures):
+                path, fingerprint = future.result()
+                if fingerprint is None:
+                    logger.warning(f"Skipping '{path}' until it changes")
+                else:
+                    logger.debug(f"Fingerprint '{path}' as {fingerprint}")
+                record[path] = {'size': stats[path].st_size,
+                                'mtime_ns': stats[path].st_mtime_ns,
+                                'ino': stats[path].st_ino,
+                                'fingerprint': fingerprint,
+                                }
+    # Copies no source maps to anymore
+    live = set(_['fingerprint'] for _ in record.values() if _['fingerprint'] is not None)
+    with os.scandir(output_dir) as it:
+        for entry in it:
+            if entry.name.endswith('.png') and entry.name[:-len('.png')] not in live:
+                logger.info(f"Remove converted copy '{entry.path}' (source no longer in library)")
+                os.unlink(entry.path)
+    if record == fingerprints:
+        return False
+    record_path = cache_path / FINGERPRINT_RECORD_NAME
+    tmp_path = record_path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f, separators=(',', ':'))
+    os.replace(tmp_path, record_path)
+    return True
+
+
+# SCREEN LAYOUT
+# eg: "DisplayPort-0 connected primary 1920x1080+0+0 (normal left inverted ...) ..."
+XRANDR_OUTPUT = re.compile(r'^(\S+) connected (?:primary )?(\d+)x(\d+)\+(\d+)\+(\d+)')
+# eg: "Screen 0: minimum 320 x 200, current 3840 x 1680, maximum 16384 x 16384"
+XRANDR_SCREEN = re.compile(r'current (\d+) x (\d+)')
+
+def current_screen_geometry():
+    """
+        Describe the current X screen layout from xrandr as a string:
+            "<screen W>x<screen H>:<W>x<H>+<X>+<Y>,..." (one entry per active output)
+        Returns None if the layout cannot be determined (ie: no X session)
+    """
+    try:
+        # --current reports the server's last known layout without re-probing
+        # every output (--query can take a noticeable time on multi-monitor setups)
+        query = subprocess.run(['xrandr', '--current'], stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True, timeout=2)
+    except Exception as e:
+        logger.warning(f"Unable to query screen geometry ({type(e)}): {e}")
+        return None
+    if query.returncode != 0:
+        logger.warning(f"Unable to query screen geometry (xrandr code: {query.returncode})")
+        return None
+    screen = XRANDR_SCREEN.search(query.stdout)
+    outputs = [XRANDR_OUTPUT.match(line) for line in query.stdout.splitlines()]
+    outputs = sorted("{1}x{2}+{3}+{4}".format(*_.groups()) for _ in outputs if _ is not None)
+    if screen is None or len(outputs) == 0:
+        logger.warning(f"Unable to parse screen geometry from xrandr: {query.stdout}")
+        return None
+    return f"{screen.group(1)}x{screen.group(2)}:{','.join(outputs)}"
+
+def parse_screen_geometry(geometry):
+    # Inverse of current_screen_geometry(): ((W, H), [(w, h, x, y), ...])
+    screen, outputs = geometry.split(':', 1)
+    screen = tuple(map(int, screen.split('x')))
+    outputs = [tuple(map(int, re.split(r'[x+]', _))) for _ in outputs.split(',')]
+    return screen, outputs
+
+def variant_map_key(text, geometry):
+    # overlay_maps key for an image pre-scaled to geometry (with overlay text, if any)
+    return f"{text if text is not None else ''}@{geometry}"
+
+def render_variant(source_path, text, overlay_size, geometry, variant_path):
+    """
+        Scale the image at source_path to fill every output in geometry
+        (cropping to preserve aspect ratio) on a canvas the size of the whole
+        X screen, applying the overlay centered on each output when text is
+        given. i3lock then displays it 1:1 instead of tiling/cropping it.
+        Returns True on success, False (with error logged) otherwise
+    """
+    try:
+        (screen_w, screen_h), outputs = parse_screen_geometry(geometry)
+        with Image.open(source_path) as source:
+            image = source.convert('RGBA')
+        canvas = Image.new('RGBA', (screen_w, screen_h), (0, 0, 0, 255))
+        # Outputs sharing a resolution share one scaled copy
+        scaled = dict()
+        for (width, height, x, y) in outputs:
+            if (width, height) not in scaled:
+                scaled[(width, height)] = ImageOps.fit(image, (width, height), method=Image.LANCZOS)
+            canvas.alpha_composite(scaled[(width, height)], (x, y))
+            if text is not None:
+                composite_overlay(canvas, text, overlay_size, (x + width // 2, y + height // 2))
+        canvas.convert('RGB').save(variant_path, format='PNG')
+    except Exception as e:
+        logger.error(f"Failed to render variant of '{source_path}' for geometry {geometry} ({type(e)}): {e}")
+        return False
+    return True
+
+def render_cache_path(cache_path, fingerprint, text, geometry=None):
+    """
+        Content-addressed cache name: the same source content rendered with
+        the same text, overlay settings and layout always maps to the same file,
+        whatever the source is called or wherever it lives
+    """
+    spec = json.dumps([fingerprint, text, OVERLAY_FONT, OVERLAY_SIZE, OVERLAY_BORDER,
+                       OVERLAY_BACKDROP_FILL, OVERLAY_BACKDROP_RADIUS, OVERLAY_BACKDROP_BLUR, OVERLAY_TEXT_FILL,
+                       geometry])
+    return cache_path / f"{hashlib.blake2b(spec.encode('utf-8'), digest_size=16).hexdigest()}.png"
+
+def cache_render(history, key, source_path, fingerprint, text, geometry=None):
+    """
+        Ensure the render of key (overlaid with text and/or pre-scaled to
+        geometry) exists in cache_path and record it in the image's overlay_maps.
+        Returns the cached path, or None if rendering failed
+    """
+    if text is not None and text not in history['overlay_sizes']:
+        # Measuring loads OVERLAY_FONT; fail like a render would so the lock
+        # falls back to the original image instead of erroring out
+        try:
+            history['overlay_sizes'][text] = calculate_overlay_size(text)
+        except Exception as e:
+            logger.error(f"Failed to measure overlay text '{text}' ({type(e)}): {e}")
+            return None
+    overlay_size = history['overlay_sizes'][text] if text is not None else None
+    cache_path = pathlib.Path(history['cache_path']).expanduser()
+    cache_path.mkdir(parents=True, exist_ok=True)
+    overlay_path = render_cache_path(cache_path, fingerprint, text, geometry)
+    map_key = text if geometry is None else variant_map_key(text, geometry)
+    if overlay_path.exists():
+        logger.info(f"Re-use cached render '{overlay_path}' for '{key}'")
+    elif geometry is None:
+        logger.info(f"Creating cached overlay image '{overlay_path}' from '{source_path}' (overlay size: {overlay_size})")
+        if not render_overlay(source_path, text, overlay_size, overlay_path):
+            return None
+    else:
+        logger.info(f"Creating cached variant '{overlay_path}' from '{source_path}' for geometry {geometry}")
+        if not render_variant(source_path, text, overlay_size, geometry, overlay_path):
+            return None
+    history['images'][key]['overlay_maps'][map_key] = str(overlay_path)
+    return overlay_path
+
+def prerender_variants(history, image_paths, fingerprints, hist_sort, keys, text, geometry):
+    """
+        Render screen-sized variants for the given keys and the prerender_count
+        highest-weighted candidates so that upcoming locks find them cached.
+        Returns True if history was modified and should be saved
+    """
+    modified = False
+    cache_path = pathlib.Path(history['cache_path']).expanduser()
+    candidates = list(keys) + list(hist_sort)[:history['prerender_count']]
+    for key in dict.fromkeys(candidates):
+        # Images without history (never selected) have nowhere to record a render yet
+        if key not in history['images'] or image_paths.get(key) is None:
+            continue
+        fingerprint = lookup_fingerprint(image_paths[key], fingerprints, cache_path)
+        variant_path = render_cache_path(cache_path, fingerprint, text, geometry)
+        if history['images'][key]['overlay_maps'].get(variant_map_key(text, geometry)) == str(variant_path) \
+                and variant_path.exists():
+            continue
+        if cache_render(history, key, image_paths[key], fingerprint, text, geometry) is not None:
+            modified = True
+    return modified
+
+
+# CACHE MANAGEMENT
+def live_renders(history, cache_path, fingerprints):
+    """
+        Every render path still reachable: each fingerprinted library content
+        with each overlay text and screen layout found in history. Renders are
+        content-addressed, so this survives renames that drop an image's
+        history (and with it the overlay_maps entry) while keeping its content
+    """
+    texts = set(history['overlay_sizes']) | {None}
+    geometries = {None}
+    for value in history['images'].values():
+        for map_key in value['overlay_maps']:
+            text, at, geometry = map_key.rpartition('@')
+            if at != '':
+                texts.add(text if text != '' else None)
+                geometries.add(geometry)
+    live = set()
+    for fingerprint in set(_['fingerprint'] for _ in fingerprints.values() if _.get('fingerprint') is not None):
+        for text in texts:
+            for geometry in geometries:
+                if text is not None or geometry is not None:
+                    live.add(str(render_cache_path(cache_path, fingerprint, text, geometry)))
+    return live
+
+def maintain_cache(history, fingerprints):
+    """
+        Keep cache_path consistent with the overlay_maps in history and within
+        history['cache_budget'] bytes:
+            overlay_maps entries whose cached file is missing are dropped
+            cached files whose content left the library (no fingerprint in
+            fingerprints renders to them) are deleted
+            while over budget, evict cached files in cache_eviction order,
+            renders no image owns right now first
+        Returns True if history was modified and should be saved
+    """
+    cache_path = pathlib.Path(history['cache_path']).expanduser()
+    if not cache_path.exists():
+        return False
+    modified = False
+    # One directory listing serves every existence check below
+    on_disk = dict()
+    with os.scandir(cache_path) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith('.png'):
+                on_disk[entry.path] = entry.stat().st_size
+    # Map each cached file back to the image that owns it
+    owners = dict()
+    for key, value in history['images'].items():
+        for text, overlay_path in list(value['overlay_maps'].items()):
+            if overlay_path not in on_disk:
+                logger.info(f"Drop overlay_maps entry '{text}' for '{key}': cached file '{overlay_path}' is missing")
+                del value['overlay_maps'][text]
+                modified = True
+                continue
+            owners[overlay_path] = (key, text)
+    # Files no library content renders to anymore (ie: source image deleted
+    # or overlay settings changed); unowned live files wait for a new owner
+    live = live_renders(history, cache_path, fingerprints).union(owners)
+    for overlay_path in set(on_disk).difference(live):
+        logger.info(f"Remove orphaned cache file '{overlay_path}'")
+        pathlib.Path(overlay_path).unlink(missing_ok=True)
+        del on_disk[overlay_path]
+
+    budget = history['cache_budget']
+    total = sum(on_disk.values())
+    logger.info(f"Cache at {cache_path} holds {total} bytes in {len(on_disk)} files (budget: {budget})")
+    if total <= budget:
+        return modified
+    policy = history['cache_eviction']
+    if policy not in CACHE_EVICTION_POLICIES:
+        logger.warning(f"Unknown cache_eviction policy '{policy}', using 'lru'")
+        policy = 'lru'
+    last_access = lambda key: history['images'][key]['last-access']
+    if policy == 'lfu':
+        rank = lambda path: (history['images'][owners[path][0]].get('access-count', 0), last_access(owners[path][0]))
+    else:
+        rank = lambda path: last_access(owners[path][0])
+    unowned = [_ for _ in on_disk if _ not in owners]
+    for overlay_path in unowned + sorted((_ for _ in on_disk if _ in owners), key=rank):
+        if total <= budget:
+            break
+        if overlay_path in owners:
+            key, text = owners[overlay_path]
+            logger.info(f"Evict cached overlay '{overlay_path}' ('{text}' for '{key}') to fit budget")
+            del history['images'][key]['overlay_maps'][text]
+            modified = True
+        else:
+            logger.info(f"Evict unowned cached render '{overlay_path}' to fit budget")
+        pathlib.Path(overlay_path).unlink(missing_ok=True)
+        total -= on_disk[overlay_path]
+    return modified
+
+def spawn_cache_maintenance(config, overlay_text=None, prerender_keys=None):
+    # Detach completely so the lock (and the shell's command substitution) never waits on it
+    logger.info(f"Spawn background cache maintenance for config {config} (prerender: {prerender_keys})")
+    command = [sys.executable, os.path.abspath(__file__), '--config', str(config), '--maintain-cache']
+    if prerender_keys is not None:
+        command += ['--prerender'] + list(prerender_keys)
+    if overlay_text is not None:
+        command += ['--overlay-text', overlay_text]
+    subprocess.Popen(command,
+                     stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+
+# SELECTION
+def pick_lock_image(history, image_paths, config, overlay_text=None, geometry=None, fingerprints=None, pending=None):
+    """
+        Make a weighted selection from image_paths (as mapped by
+        selectable_paths(), with its pending keys), record it in history and
+        resolve the file i3lock should display: a variant pre-scaled to
+        geometry if cached, else the (possibly newly rendered) overlay, else
+        the original image. Cached renders are found by content-addressed
+        name (see render_cache_path()), so each lookup is a single stat; an
+        image the background job has not fingerprinted yet is shown as-is.
+        Returns the path to display
+    """
+    # Removing images from history orphans their cached overlays
+    overlay_owners = set(key for key, value in history['images'].items() if len(value['overlay_maps']) > 0)
+    history, hist_sort = set_weights(history, image_paths)
+    cache_dirty = not overlay_owners.issubset(history['images'])
+    # Let the background job convert images that are not PNGs yet
+    if pending:
+        cache_dirty = True
+
+    # Make weighted choice
+    selected_key = make_weighted_choice(hist_sort)
+    events = [update_last_access(history, selected_key)]
+    selected_path = image_paths[selected_key]
+    overlay_maps = history['images'][selected_key]['overlay_maps']
+    recorded_maps = dict(overlay_maps)
+    def record_render(map_key, render_path):
+        # Attribute the render to this image (for eviction) unless already recorded
+        if recorded_maps.get(map_key) == str(render_path):
+            return
+        overlay_maps[map_key] = str(render_path)
+        events.append({'event': 'render',
+                       'key': selected_key,
+                       'map': map_key,
+                       'path': str(render_path),
+                       'text': overlay_text,
+                       'size': history['overlay_sizes'].get(overlay_text),
+                       })
+    fingerprint = None
+    if overlay_text is not None or geometry is not None:
+        cache_path = pathlib.Path(history['cache_path']).expanduser()
+        fingerprint = lookup_fingerprint(selected_path, fingerprints if fingerprints is not None else dict(), cache_path, compute=False)
+        if fingerprint is None:
+            # Not fingerprinted yet (new, changed or moved): show the original
+            # now and let the background job fingerprint it for next time
+            logger.info(f"No recorded fingerprint for '{selected_path}', use it as-is")
+            cache_dirty = True
+    # Prefer a render pre-scaled to the current screen layout; these are only
+    # produced in the background so the lock never waits on scaling
+    prerender_keys = None
+    variant_path = None
+    if fingerprint is not None and geometry is not None:
+        variant_path = render_cache_path(cache_path, fingerprint, overlay_text, geometry)
+    if variant_path is not None and variant_path.exists():
+        logger.info(f"Use cached variant '{variant_path}' for geometry {geometry}")
+        record_render(variant_map_key(overlay_text, geometry), variant_path)
+        selected_path = variant_path
+    elif fingerprint is not None:
+        if geometry is not None:
+            prerender_keys = [selected_key]
+        # If user requests an overlay, edit the image and cache it, then adjust the selected path
+        if overlay_text is not None:
+            overlay_path = render_cache_path(cache_path, fingerprint, overlay_text)
+            if not overlay_path.exists():
+                overlay_path = cache_render(history, selected_key, selected_path, fingerprint, overlay_text)
+                cache_dirty = True
+            if overlay_path is None:
+                logger.error("Failed to create overlay image! Revert to original selection")
+            else:
+                record_render(overlay_text, overlay_path)
+                selected_path = overlay_path
+
+    # Update history on disk!
+    if append_history_events(config, events) > WAL_COMPACT_BYTES:
+        cache_dirty = True
+    if cache_dirty or prerender_keys is not None:
+        spawn_cache_maintenance(config, overlay_text, prerender_keys)
+    return selected_path
+
+def lock_command(selected_path):
+    escaped_path = f'"{selected_path}"'
+    command = ['i3lock', '-utfe', '-i', escaped_path]
+    # For whatever reason, directly calling subprocess doesn't work even with shell=True and other considerations (typically related to spaces in the file path).
+    # However, we're wrapping this script in a shell script anyways that can eval this / fall back in the event we returned nonzero value due to any errors we catch above
+    # This also means if I failed to catch an exception, we won't attempt to eval a stacktrace
+    return ' '.join(command)
+
+
+# RESIDENT DAEMON
+# Requests are one line of tab-separated fields, answered by one line:
+#   "pick[\t<overlay text>]" -> i3lock command (as printed by a one-shot run)
+#   "ping" -> "pong"
+# Failures are answered with a line starting with "ERROR" so the client can
+# fall back to a one-shot run
+default_socket_path = pathlib.Path(os.getenv('XDG_RUNTIME_DIR', '/tmp')) / f"{os.environ['USER']}_pick_sleep_background.sock"
+
+class PickerState:
+    """
+        History, library index and screen geometry kept hot between picks.
+        History is reloaded only when the config file changes underneath us
+        (CLI edits or the background cache maintenance job) and otherwise
+        catches up on the selection log, and the library index is refreshed
+        incrementally (one stat per directory) per pick. The daemon also
+        catches up on history right after answering a pick, so a reload
+        triggered by that pick's compaction or maintenance job is usually
+        done before the next lock.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.history = None
+        self.config_mtime_ns = None
+        self.index = None
+        self.index_path = None
+        self.fingerprints = dict()
+        self.fingerprints_mtime_ns = None
+        self.geometry = current_screen_geometry()
+
+    def refresh_history(self):
+        mtime_ns = os.stat(self.config).st_mtime_ns if self.config.exists() else None
+        if self.history is None or mtime_ns != self.config_mtime_ns:
+            logger.info(f"(Re)load history from {self.config}")
+            self.history = load_history(self.config)
+            self.config_mtime_ns = os.stat(self.config).st_mtime_ns
+            index_path = pathlib.Path(self.history['cache_path']).expanduser() / LIBRARY_INDEX_NAME
+            if index_path != self.index_path:
+                self.index = load_library_index(index_path)
+                self.index_path = index_path
+        else:
+            # Selections other processes (eg: the one-shot fallback) logged
+            # since; only the unread tail of the log is read
+            replay_history_events(self.history, self.config)
+
+    def refresh(self):
+        self.refresh_history()
+        image_paths, changed = refresh_library_index(self.index, library_roots(self.history))
+        if changed:
+            save_library_index(self.index, self.index_path)
+        # The background job rewrites the fingerprint record as it converts
+        cache_path = pathlib.Path(self.history['cache_path']).expanduser()
+        record_path = cache_path / FINGERPRINT_RECORD_NAME
+        mtime_ns = os.stat(record_path).st_mtime_ns if record_path.exists() else None
+        if mtime_ns != self.fingerprints_mtime_ns:
+            self.fingerprints = load_fingerprints(cache_path)
+            self.fingerprints_mtime_ns = mtime_ns
+        return selectable_paths(image_paths, cache_path, self.fingerprints)
+
+    def pick(self, overlay_text):
+        image_paths, pending = self.refresh()
+        selected_path = pick_lock_image(self.history, image_paths, self.config, overlay_text, self.geometry, self.fingerprints, pending)
+        return lock_command(selected_path)
+
+class PickRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = self.rfile.readline().decode('utf-8').rstrip('\n').split('\t')
+        logger.info(f"Daemon request: {request}")
+        state = self.server.state
+        try:
+            if request[0] == 'pick':
+                reply = state.pick(request[1] if len(request) > 1 and request[1] != '' else None)
+            elif request[0] == 'ping':
+                reply = 'pong'
+            else:
+                reply = f"ERROR unknown request '{request[0]}'"
+        # load_history() exits on malformed configs -- that must not kill the daemon
+        except (Exception, SystemExit) as e:
+            logger.error(f"Daemon failed to handle request {request} ({type(e)}): {e}")
+            # Start from disk again on the next request
+            state.history = None
+            reply = f"ERROR {type(e).__name__}"
+        self.wfile.write((reply+'\n').encode('utf-8'))
+        self.wfile.flush()
+        if request[0] == 'pick':
+            # Refresh after answering so layout and history changes are seen by the next lock
+            state.geometry = current_screen_geometry()
+            try:
+                state.refresh_history()
+            except (Exception, SystemExit) as e:
+                logger.error(f"Daemon could not refresh history ({type(e)}): {e}")
+                state.history = None
+
+def run_daemon(config, socket_path=default_socket_path):
+    # Refuse to start twice; a socket file nobody answers on is stale
+    if socket_path.exists():
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                probe.connect(str(socket_path))
+            logger.error(f"Daemon already listening on {socket_path}")
+            return
+        except OSError:
+            socket_path.unlink()
+    server = socketserver.UnixStreamServer(str(socket_path), PickRequestHandler)
+    server.state = PickerState(config)
+    try:
+        # Warm everything up front so the first lock is as fast as the rest
+        server.state.refresh()
+    except (Exception, SystemExit) as e:
+        logger.error(f"Daemon could not preload history ({type(e)}): {e}")
+        server.state.history = None
+    logger.info(f"Daemon listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        socket_path.unlink(missing_ok=True)
 
 
 # COMMANDLINE PARSING
@@ -305,8 +1329,8 @@ def build():
     parser.add_argument('--values-adjust', nargs="*", default=None, action='append',
                         help=f"List of TOP-LEVEL values to adjust in config")
     #           + Forcing images to be indexed into history (sets last-access etc)
-    parser.add_argument('--index', type=pathlib.Path, default=None, nargs="*", action='append',
-                        help=f"Index images (relative to base path; touch its last-access / initialize its config entry)")
+    parser.add_argument('--index', type=str, default=None, nargs="*", action='append',
+                        help=f"Index images, directories or globs (image keys, or paths relative to base path; touch last-access / initialize config entries)")
     #           + Adjusting the penalty weight of an image / other config
     parser.add_argument('--penalize-images', type=pathlib.Path, nargs="*", default=None,
                         action='append', help=f"Images to set individual penalty weights for")
@@ -320,7 +1344,15 @@ def build():
                         help=f"Parse JSON at --config path to ensure it has no errors {dhelp}")
     parser.add_argument('--parse-with-weights', action='store_true',
                         help=f"Parse JSON at --config path and show resulting weights {dhelp}")
+    #           + Trimming the image cache
+    parser.add_argument('--maintain-cache', action='store_true',
+                        help=f"Garbage-collect and evict cached images to fit cache_budget, then exit {dhelp}")
+    parser.add_argument('--prerender', nargs="*", default=None,
+                        help=f"With --maintain-cache: render screen-sized variants for these image keys and the top-weighted images {dhelp}")
     #           + Editing the image
+    #           + Running resident
+    parser.add_argument('--daemon', action='store_true',
+                        help=f"Stay resident and answer picks over a Unix socket at {default_socket_path} {dhelp}")
     parser.add_argument('--overlay-text', default=None,
                         help=f"Overlay text on the image (caches a new image per unique text) {dhelp}")
     return parser
@@ -358,13 +1390,19 @@ def parse(args=None, prs=None):
                 'frequency-weight-multiplier': int,
                 'new-image-weight-advantage': float,
                 'base_path': str,
+                'cache_path': str,
+                'cache_budget': int,
+                'cache_eviction': str,
+                'prerender_count': int,
+                # Multiple roots are given like PATH (colon-separated)
+                'library_roots': lambda v: [_ for _ in v.split(os.pathsep) if _ != ''],
                 }
         args.top_level_config_edits = dict((k,type_map[k](v)) for (k,v) in zip(args.keys_adjust, args.values_adjust))
     else:
         args.top_level_config_edits = None
 
     if args.index is not None:
-        # Have to be relative to config's base path -- FileNotFoundError later if not found
+        # Resolved against the library index -- FileNotFoundError later if nothing matches
         args.index = flatten_arg(args.index)
 
     require_simultaneously_set_and_equal_length(args, 'penalize_images','penalize_weights')
@@ -382,6 +1420,10 @@ if __name__ == '__main__':
     args = parse()
     logger.info(f"Starting pick_sleep_background.py with args {args}")
 
+    if args.daemon:
+        run_daemon(args.config)
+        exit(0)
+
     # User requests new config file
     if args.init:
         init_history(args.config)
@@ -406,13 +1448,8 @@ if __name__ == '__main__':
 
     # User requests one or more images to be indexed into history
     if args.index is not None:
-        for idx, image in enumerate(args.index):
-            if not (config_base_path / image).exists():
-                raise FileNotFoundError(f"Could not locate image {image} at {config_base_path}")
-            history['images'][image] = new_history_for_image()
-            if idx < len(args.index)-1:
-                logger.debug("Sleep 1s to maintain separate last-access timings")
-                time.sleep(1)
+        index_path = pathlib.Path(history['cache_path']).expanduser() / LIBRARY_INDEX_NAME
+        bulk_index(history, resolve_index_targets(args.index, scan_library(history, index_path), config_base_path))
 
     # User requests penalty adjustments
     if args.image_penalties is not None:
@@ -428,79 +1465,57 @@ if __name__ == '__main__':
                 raise ValueError(f"Image {image} is not indexed in configuration history {args.config}")
             history['images'][image]['omit'] = not history['images'][image]['omit']
 
+    index_path = pathlib.Path(history['cache_path']).expanduser() / LIBRARY_INDEX_NAME
+
+    # Selections only append to the log, so persist CLI edits right away
+    if any(_ is not None for _ in [args.top_level_config_edits, args.index, args.image_penalties, args.image_toggle_omit]):
+        save_history(history, args.config)
+
     # ALL CMDLINE EDITS OVER (excluding image edits)
+    cache_path = pathlib.Path(history['cache_path']).expanduser()
+    if args.maintain_cache:
+        # Only one background job at a time; a newer request is covered by the running one
+        cache_path.mkdir(parents=True, exist_ok=True)
+        maintenance_lock = open(cache_path / '.maintenance.lock', 'w')
+        try:
+            fcntl.flock(maintenance_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info("Another cache maintenance job is running, exit")
+            exit(0)
+        loaded_maps = loaded_overlay_maps(history)
+        image_paths = scan_library(history, index_path)
+        fingerprint_library(history, image_paths)
+        fingerprints = load_fingerprints(cache_path)
+        image_paths, _ = selectable_paths(image_paths, cache_path, fingerprints)
+        # Locks drop vanished images from history only in memory (the log has
+        # no event for it); persist that here so they stop flagging the cache dirty
+        known_images = len(history['images'])
+        history, hist_sort = set_weights(history, image_paths)
+        modified = len(history['images']) != known_images
+        if args.prerender is not None:
+            geometry = current_screen_geometry()
+            if geometry is not None:
+                modified = prerender_variants(history, image_paths, fingerprints, hist_sort, args.prerender, args.overlay_text, geometry) or modified
+        # Trim after rendering so new variants count towards the budget
+        modified = maintain_cache(history, fingerprints) or modified
+        # Always compact pending log entries while we're in the background anyway
+        wal_path = wal_path_for(args.config)
+        if modified or (wal_path.exists() and wal_path.stat().st_size > 0):
+            save_history(history, args.config, loaded_maps)
+        exit(0)
     if args.parse:
         import pprint
         pprint.pprint(history)
         exit(0)
 
-    history, hist_sort = set_weights(history, config_base_path)
+    fingerprints = load_fingerprints(cache_path)
+    image_paths, pending = selectable_paths(scan_library(history, index_path), cache_path, fingerprints)
     if args.parse_with_weights:
         import pprint
+        history, hist_sort = set_weights(history, image_paths)
         pprint.pprint(history)
         pprint.pprint(hist_sort)
         exit(0)
 
-    # Make weighted choice
-    selected_key = make_weighted_choice(hist_sort)
-    update_last_access(history, selected_key, args.config)
-    # If user requests an overlay, edit the image and cache it, then adjust the selected path
-    if args.overlay_text is not None:
-        if args.overlay_text not in history['overlay_sizes']:
-            history['overlay_sizes'][args.overlay_text] = calculate_overlay_size(args.overlay_text)
-        overlay_size = history['overlay_sizes'][args.overlay_text]
-        logger.info(f"Overlay size for text '{args.overlay_text}': {overlay_size}")
-        # Cache the image with overlay applied
-        cache_path = pathlib.Path(history['cache_path']).expanduser()
-        cache_path.mkdir(parents=True, exist_ok=True)
-        remap = args.overlay_text in history['images'][selected_key]['overlay_maps']
-        if not remap:
-            # Set unique name
-            overlay_id = 0
-            convert_skey = pathlib.Path(history['base_path']).expanduser() / selected_key
-            skey_stem = pathlib.Path(selected_key).stem
-            overlay_path = cache_path / f"{skey_stem}_{overlay_id}.png"
-            while overlay_path.exists():
-                overlay_id += 1
-                overlay_path = cache_path / f"{skey_stem}_{overlay_id}.png"
-            # Create the cached overlay image
-            cmd_pt1 = ["convert",f"{convert_skey}"]+(f"( -background none -fill white "+\
-                      f"-font {OVERLAY_FONT} -pointsize {OVERLAY_SIZE}").split()
-            cmd_pt2 = [f"label:{args.overlay_text}"]
-            cmd_pt3 = (f"-trim +repage -bordercolor none "+\
-                      f"-border {OVERLAY_BORDER} -alpha set -channel A "+\
-                      f"-evaluate set 0 +channel -fill rgba(0,0,0,0.6) "+\
-                      f"-draw").split()
-            cmd_pt4 = [f"roundrectangle 0,0 {overlay_size} 10,10"]
-            cmd_pt5 = (f"-blur 0x3 ) -gravity center -compose over -composite "+\
-                      f"-font {OVERLAY_FONT} -pointsize {OVERLAY_SIZE} "+\
-                      f"-fill white -gravity center -annotate +0+0").split()
-            cmd_pt6 = [f"{args.overlay_text}"]
-            cmd_pt7 = [f"{overlay_path}"]
-            cmd = cmd_pt1+cmd_pt2+cmd_pt3+cmd_pt4+cmd_pt5+cmd_pt6+cmd_pt7
-            logger.info(f"Creating cached overlay image via command: {cmd}")
-            result = subprocess.run(cmd)
-            if result.returncode != 0:
-                logger.error(f"Failed to create overlay image (code: {result.returncode})!"+\
-                             "Revert to original selection")
-            else:
-                # Map into history and re-pick
-                history['images'][selected_key]['overlay_maps'][args.overlay_text] = str(overlay_path)
-                remap = True
-                # Update history on disk!
-                with open(args.config, 'w') as f:
-                    logger.info(f"Update config {args.config} with latest selection and metadata")
-                    logger.debug(history)
-                    json.dump(history, f)
-        if remap:
-            selected_key = history['images'][selected_key]['overlay_maps'][args.overlay_text]
-
-    # Form command for output
-    basic_path = config_base_path.joinpath(selected_key)
-    escaped_path = f'"{basic_path}"'
-    command = ['i3lock', '-utfe', '-i', escaped_path]
-    # For whatever reason, directly calling subprocess doesn't work even with shell=True and other considerations (typically related to spaces in the file path).
-    # However, we're wrapping this script in a shell script anyways that can eval this / fall back in the event we returned nonzero value due to any errors we catch above
-    # This also means if I failed to catch an exception, we won't attempt to eval a stacktrace
-    print(' '.join(command))
-
+    selected_path = pick_lock_image(history, image_paths, args.config, args.overlay_text, current_screen_geometry(), fingerprints, pending)
+    print(lock_command(selected_path))
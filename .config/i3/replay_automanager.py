@@ -0,0 +1,225 @@
+# Record / replay harness for automanager.py
+# Record the i3 IPC event stream (window, workspace and tick events plus tree
+# snapshots) of a live session, then replay it as fast as possible through
+# automanager's handlers against a stand-in connection that counts the
+# commands they issue instead of running them. Replays need no X server or i3.
+# Events are fed back to back, so time-based logic is compressed: a whole
+# recording usually lands within one RENAME_DEBOUNCE and PLACEMENT_DELAY window
+# (coalescing far more than live) and PLACEMENT_TIMEOUT handovers never expire.
+# Use the --rename-debounce/--placement-delay/--placement-timeout overrides to
+# shrink those windows; the report records the values used.
+#
+# USAGE: python3 replay_automanager.py record events.jsonl   (Ctrl-C to stop)
+#        python3 replay_automanager.py replay events.jsonl [--show-commands] [--output report.json]
+#        Compare --output reports between changes to automanager.py
+
+# Builtin modules
+import argparse
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+# Dependent modules
+import i3ipc
+from i3ipc.aio import Con, Connection
+
+# Local
+import automanager as am
+
+# Record kind: event class it is replayed as
+EVENT_KINDS = {'window': i3ipc.WindowEvent,
+               'workspace': i3ipc.WorkspaceEvent,
+               'tick': i3ipc.TickEvent,
+               }
+
+def build():
+    dhelp = "(Default: %(default)s)"
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=['record', 'replay'],
+                        help="Record the live i3 session's events to path, or replay them from path")
+    parser.add_argument('path', type=pathlib.Path,
+                        help="Recording (JSON lines)")
+    parser.add_argument('--snapshot-interval', type=float, default=5,
+                        help=f"record: Minimum seconds between tree snapshots taken after events {dhelp}")
+    parser.add_argument('--settings', type=pathlib.Path,
+                        default=pathlib.Path(os.getenv('HOME')) / '.config' / 'i3' / f"{os.environ['USER']}_settings.json",
+                        help=f"replay: automanager settings to replay with {dhelp}")
+    parser.add_argument('--rename-debounce', type=float, default=None,
+                        help=f"replay: Override automanager's RENAME_DEBOUNCE seconds {dhelp}")
+    parser.add_argument('--placement-delay', type=float, default=None,
+                        help=f"replay: Override automanager's PLACEMENT_DELAY seconds {dhelp}")
+    parser.add_argument('--placement-timeout', type=float, default=None,
+                        help=f"replay: Override automanager's PLACEMENT_TIMEOUT seconds {dhelp}")
+    parser.add_argument('--show-commands', action='store_true',
+                        help=f"replay: Print every command automanager issued {dhelp}")
+    parser.add_argument('--output', type=pathlib.Path, default=None,
+                        help=f"replay: Write the report as JSON to this path {dhelp}")
+    parser.add_argument('--verbose', action='store_true',
+                        help=f"Show automanager's debug logging on stderr {dhelp}")
+    return parser
+
+def parse(args=None, prs=None):
+    if prs is None:
+        prs = build()
+    if args is None:
+        args = prs.parse_args()
+    if args.mode == 'replay' and not args.path.exists():
+        raise FileNotFoundError(f"No recording at {args.path}")
+    return args
+
+# RECORD
+
+async def record(path, snapshot_interval):
+    i3 = await Connection().connect()
+    start = time.monotonic()
+    counts = dict()
+    with open(path, 'w') as f:
+        def write(kind, data):
+            f.write(json.dumps({'t': round(time.monotonic() - start, 6), 'kind': kind, 'data': data}, separators=(',', ':')) + '\n')
+            counts[kind] = counts.get(kind, 0) + 1
+
+        write('tree', (await i3.get_tree()).ipc_data)
+        last_snapshot = time.monotonic()
+
+        async def on_event(i3, e):
+            nonlocal last_snapshot
+            kind = next(kind for kind, event_type in EVENT_KINDS.items() if isinstance(e, event_type))
+            write(kind, e.ipc_data)
+            # Trees let the replay answer the get_tree() calls a dirty mirror makes
+            if time.monotonic() - last_snapshot >= snapshot_interval:
+                last_snapshot = time.monotonic()
+                write('tree', (await i3.get_tree()).ipc_data)
+
+        for kind in EVENT_KINDS:
+            i3.on(kind, on_event)
+        print(f"Recording to {path}, Ctrl-C to stop", file=sys.stderr)
+        try:
+            await i3.main()
+        finally:
+            print(f"Recorded {counts}", file=sys.stderr)
+
+# REPLAY
+
+class ReplayConnection():
+    """
+        Stand-in for i3ipc.aio.Connection: get_tree() answers with the latest
+        recorded tree snapshot, command() records the command and reports
+        success without running anything, and emit() hands a recorded event
+        to the subscribed handlers in subscription order
+    """
+    def __init__(self):
+        self.tree = None
+        self.subscriptions = list()
+        self.commands = list()
+        self.tree_requests = 0
+
+    def on(self, event, handler):
+        event, _, detail = event.replace('-', '_').partition('::')
+        self.subscriptions.append((event, detail, handler))
+
+    async def get_tree(self):
+        self.tree_requests += 1
+        return Con(self.tree, None, self)
+
+    async def command(self, command):
+        self.commands.append(command)
+        return [i3ipc.CommandReply({'success': True}) for _ in command.split(';')]
+
+    async def emit(self, kind, e):
+        for event, detail, handler in self.subscriptions:
+            if event != kind or (detail and detail != getattr(e, 'change', None)):
+                continue
+            result = handler(self, e)
+            if asyncio.iscoroutine(result):
+                await result
+
+def load_recording(path):
+    with open(path, 'r') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if len(records) == 0 or records[0]['kind'] != 'tree':
+        raise ValueError(f"{path} does not start with a tree snapshot")
+    return records
+
+def make_event(kind, data, conn):
+    if kind == 'tick':
+        return i3ipc.TickEvent(data)
+    return EVENT_KINDS[kind](data, conn, _Con=Con)
+
+async def replay(records, args):
+    am.settings = am.load_settings(args.settings)
+    am.settings['ticks'] = dict()
+    am.rules = am.compile_rules(am.settings)
+    am.stats_path = pathlib.Path(tempfile.gettempdir()) / f"{os.environ['USER']}_automanager_replay_stats.json"
+    if args.rename_debounce is not None:
+        am.RENAME_DEBOUNCE = args.rename_debounce
+    if args.placement_delay is not None:
+        am.PLACEMENT_DELAY = args.placement_delay
+    if args.placement_timeout is not None:
+        am.PLACEMENT_TIMEOUT = args.placement_timeout
+
+    conn = ReplayConnection()
+    conn.tree = records[0]['data']
+    counts = dict()
+    start = time.perf_counter()
+    workers = await am.attach(conn)
+    for rec in records[1:]:
+        if rec['kind'] == 'tree':
+            conn.tree = rec['data']
+            continue
+        counts[rec['kind']] = counts.get(rec['kind'], 0) + 1
+        await conn.emit(rec['kind'], make_event(rec['kind'], rec['data'], conn))
+        # Let the workers interleave with the event stream as they would live
+        await asyncio.sleep(0)
+    fed = time.perf_counter()
+    for queue in am.queues.values():
+        await queue.queue.join()
+    if am.placements.flush_task is not None:
+        await am.placements.flush_task
+    done = time.perf_counter()
+    for worker in workers:
+        worker.cancel()
+
+    events = sum(counts.values())
+    return {'recording': {'events': counts,
+                          'duration_s': records[-1]['t'],
+                          },
+            'timing': {'rename_debounce': am.RENAME_DEBOUNCE,
+                       'placement_delay': am.PLACEMENT_DELAY,
+                       'placement_timeout': am.PLACEMENT_TIMEOUT,
+                       },
+            'replay': {'feed_s': fed - start,
+                       'total_s': done - start,
+                       'events_per_s': events / (fed - start) if fed > start else None,
+                       'commands': len(conn.commands),
+                       'tree_requests': conn.tree_requests,
+                       },
+            'stats': am.collect_stats(),
+            }, conn.commands
+
+if __name__ == '__main__':
+    args = parse()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s: %(message)s")
+    if args.mode == 'record':
+        try:
+            asyncio.run(record(args.path, args.snapshot_interval))
+        except KeyboardInterrupt:
+            pass
+        exit(0)
+
+    report, commands = asyncio.run(replay(load_recording(args.path), args))
+    if args.show_commands:
+        for command in commands:
+            print(command)
+    print(f"Replayed {report['recording']['events']} ({report['recording']['duration_s']:.1f}s recorded) "
+          f"in {report['replay']['total_s']*1000:.1f}ms")
+    for key, value in report['replay'].items():
+        print(f"  {key:<14} {value:.4f}" if isinstance(value, float) else f"  {key:<14} {value}")
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
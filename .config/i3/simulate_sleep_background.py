@@ -0,0 +1,205 @@
+# Simulation / benchmark harness for pick_sleep_background.py
+# Replays synthetic lock events against a generated history to measure how
+# long set_weights() and make_weighted_choice() take per pick and how fairly
+# images get selected under the configured multipliers.
+#
+# USAGE: python3 simulate_sleep_background.py [--images 2000] [--events 5000] ...
+#        Save a run with --output results.json, then compare later runs against
+#        it with --baseline results.json when tuning weights or changing code
+
+# Builtin modules
+import argparse
+import datetime
+import json
+import logging
+import pathlib
+import sys
+import time
+
+# pick_sleep_background configures logging to its lock log at import time; claim
+# the root logger first so simulated picks don't flood (or require) that file
+logging.basicConfig(handlers=[logging.NullHandler()], level=logging.WARNING)
+
+# Dependent modules
+import numpy as np
+
+# Local
+import pick_sleep_background as psb
+
+def build():
+    dhelp = "(Default: %(default)s)"
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=500,
+                        help=f"Number of images in the synthetic library {dhelp}")
+    parser.add_argument('--history-fraction', type=float, default=0.8,
+                        help=f"Fraction of the library already present in history {dhelp}")
+    parser.add_argument('--penalized-fraction', type=float, default=0.05,
+                        help=f"Fraction of history given a penalty-weight {dhelp}")
+    parser.add_argument('--penalty', type=int, default=2,
+                        help=f"penalty-weight assigned to penalized images {dhelp}")
+    parser.add_argument('--omitted-fraction', type=float, default=0.01,
+                        help=f"Fraction of history flagged omit {dhelp}")
+    parser.add_argument('--events', type=int, default=5000,
+                        help=f"Number of lock events to replay {dhelp}")
+    parser.add_argument('--event-interval', type=float, default=3600,
+                        help=f"Simulated seconds between lock events {dhelp}")
+    parser.add_argument('--seed', type=int, default=None,
+                        help=f"Seed for the generated history and the selection RNG {dhelp}")
+    # Multipliers under test (same names as the history's top-level keys)
+    parser.add_argument('--penalty-weight-multiplier', type=int, default=-1,
+                        help=f"History 'penalty-weight-multiplier' {dhelp}")
+    parser.add_argument('--frequency-weight-multiplier', type=int, default=1,
+                        help=f"History 'frequency-weight-multiplier' {dhelp}")
+    parser.add_argument('--new-image-weight-advantage', type=float, default=1,
+                        help=f"History 'new-image-weight-advantage' {dhelp}")
+    parser.add_argument('--output', type=pathlib.Path, default=None,
+                        help=f"Write the report as JSON to this path {dhelp}")
+    parser.add_argument('--baseline', type=pathlib.Path, default=None,
+                        help=f"JSON report of an earlier run to compare against {dhelp}")
+    return parser
+
+def parse(args=None, prs=None):
+    if prs is None:
+        prs = build()
+    if args is None:
+        args = prs.parse_args()
+    for name in ['history_fraction', 'penalized_fraction', 'omitted_fraction']:
+        if not 0 <= getattr(args, name) <= 1:
+            raise ValueError(f"--{name.replace('_','-')} must be within [0, 1]")
+    return args
+
+def generate_history(args, rng, start):
+    """
+        Synthetic library (key -> path, never touched on disk) and a history
+        whose last-access times are spread over the interval preceding start
+    """
+    image_paths = dict((f"image_{idx:06d}.png", pathlib.Path(f"/nonexistent/image_{idx:06d}.png")) for idx in range(args.images))
+    history = {"penalty-weight-multiplier": args.penalty_weight_multiplier,
+               "frequency-weight-multiplier": args.frequency_weight_multiplier,
+               "new-image-weight-advantage": args.new_image_weight_advantage,
+               "images": {},
+               }
+    keys = list(image_paths)
+    in_history = rng.choice(len(keys), size=int(len(keys)*args.history_fraction), replace=False)
+    for order, key_idx in enumerate(rng.permutation(in_history)):
+        entry = psb.new_history_for_image()
+        entry['last-access'] = start - datetime.timedelta(seconds=args.event_interval * (order+1))
+        if rng.random() < args.penalized_fraction:
+            entry['penalty-weight'] = args.penalty
+        if rng.random() < args.omitted_fraction:
+            entry['omit'] = True
+        history['images'][keys[key_idx]] = entry
+    return history, image_paths
+
+def latency_summary(samples_ns):
+    samples_us = np.asarray(samples_ns) / 1000
+    return {'mean_us': float(np.mean(samples_us)),
+            'p50_us': float(np.percentile(samples_us, 50)),
+            'p95_us': float(np.percentile(samples_us, 95)),
+            'p99_us': float(np.percentile(samples_us, 99)),
+            'max_us': float(np.max(samples_us)),
+            }
+
+def gini(counts):
+    # 0 == every image picked equally often, ->1 == a single image gets every pick
+    counts = np.sort(np.asarray(counts, dtype=float))
+    if counts.sum() == 0:
+        return 0.0
+    ranks = np.arange(1, len(counts)+1)
+    return float((2*np.sum(ranks*counts)) / (len(counts)*counts.sum()) - (len(counts)+1)/len(counts))
+
+def fairness_summary(history, image_paths, selections):
+    omitted = set(key for key, value in history['images'].items() if value['omit'])
+    penalized = set(key for key, value in history['images'].items() if value['penalty-weight'] != 0)
+    pool = [key for key in image_paths if key not in omitted]
+    counts = dict((key, 0) for key in pool)
+    last_seen = dict()
+    gaps = list()
+    for event_idx, key in enumerate(selections):
+        counts[key] = counts.get(key, 0) + 1
+        if key in last_seen:
+            gaps.append(event_idx - last_seen[key])
+        last_seen[key] = event_idx
+    values = np.asarray(list(counts.values()), dtype=float)
+    # A perfectly fair rotation re-picks an image every len(pool) events
+    short_window = max(1, len(pool) // 10)
+    penalized_picks = sum(counts.get(key, 0) for key in penalized)
+    return {'pool_size': len(pool),
+            'never_selected_fraction': float(np.mean(values == 0)),
+            'selections_mean': float(values.mean()),
+            'selections_cv': float(values.std() / values.mean()) if values.mean() > 0 else 0.0,
+            'selections_gini': gini(values),
+            'gap_mean': float(np.mean(gaps)) if len(gaps) > 0 else None,
+            'gap_p5': float(np.percentile(gaps, 5)) if len(gaps) > 0 else None,
+            'gap_ideal': len(pool),
+            'repeat_within_10pct_pool': float(np.mean(np.asarray(gaps) <= short_window)) if len(gaps) > 0 else None,
+            'omitted_selected': sum(1 for key in selections if key in omitted),
+            'penalized_share': penalized_picks / len(selections) if len(selections) > 0 else 0.0,
+            'penalized_pool_share': len(penalized) / len(pool) if len(pool) > 0 else 0.0,
+            }
+
+def simulate(args):
+    rng = np.random.default_rng(args.seed)
+    clock = datetime.datetime.now().replace(microsecond=0)
+    history, image_paths = generate_history(args, rng, clock)
+    # Selections draw from their own seeded generator for repeatability
+    pick_rng = np.random.default_rng(rng.integers(2**32))
+
+    weight_ns, choice_ns, selections = list(), list(), list()
+    for _ in range(args.events):
+        clock += datetime.timedelta(seconds=args.event_interval)
+        t0 = time.perf_counter_ns()
+        history, hist_sort = psb.set_weights(history, image_paths)
+        t1 = time.perf_counter_ns()
+        selected_key = psb.make_weighted_choice(hist_sort, pick_rng)
+        t2 = time.perf_counter_ns()
+        # Stamp selections with simulated time instead of the wall clock
+        psb.update_last_access(history, selected_key, clock)
+        weight_ns.append(t1-t0)
+        choice_ns.append(t2-t1)
+        selections.append(selected_key)
+
+    return {'parameters': dict((k, v) for k, v in vars(args).items() if k not in ['output', 'baseline']),
+            'latency': {'set_weights': latency_summary(weight_ns),
+                        'make_weighted_choice': latency_summary(choice_ns),
+                        },
+            'fairness': fairness_summary(history, image_paths, selections),
+            }
+
+def show(report, baseline=None):
+    print("Parameters: " + ", ".join(f"{k}={v}" for k, v in report['parameters'].items()))
+    for section in ['latency', 'fairness']:
+        print(f"\n{section.upper()}")
+        rows = list()
+        if section == 'latency':
+            for func, stats in report['latency'].items():
+                for stat, value in stats.items():
+                    old = None if baseline is None else baseline['latency'].get(func, {}).get(stat)
+                    rows.append((f"{func}.{stat}", value, old))
+        else:
+            for stat, value in report['fairness'].items():
+                old = None if baseline is None else baseline['fairness'].get(stat)
+                rows.append((stat, value, old))
+        width = max(len(_[0]) for _ in rows)
+        for name, value, old in rows:
+            line = f"  {name:<{width}}  {value if value is not None else 'N/A':>14.4f}" if isinstance(value, float) \
+                   else f"  {name:<{width}}  {str(value):>14}"
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)):
+                delta = value - old
+                pct = f" ({100*delta/old:+.1f}%)" if old != 0 else ""
+                line += f"   baseline {old:.4f}  delta {delta:+.4f}{pct}"
+            print(line)
+
+if __name__ == '__main__':
+    args = parse()
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline['parameters'] != dict((k, v) for k, v in vars(args).items() if k not in ['output', 'baseline']):
+            print(f"WARNING: baseline parameters differ: {baseline['parameters']}", file=sys.stderr)
+    report = simulate(args)
+    show(report, baseline)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
@@ -18,9 +18,19 @@ fi
 # This script picks a lockscreen / sleep background on rotation
 # You can initialize its config by running the script directly and can edit
 # other settings via this script (run with --help for options)
-i3lockcmd=$(python3 ${HOME}/.config/i3/pick_sleep_background.py --overlay-text "${USER}");
-if [[ $? -ne 0 ]]; then
-    echo "SLEEPLOCK.SH ERROR CODE: $?" >> ${MY_LOCK_LOG};
+# Ask the resident picker (pick_sleep_background.py --daemon) first; if it is
+# not running, fails or is too busy to answer within a few seconds, fall back
+# to a one-shot run of the script (at worst logging one extra selection)
+MY_PICKER_SOCKET="${XDG_RUNTIME_DIR:-/tmp}/${USER}_pick_sleep_background.sock";
+i3lockcmd=$(python3 -S ${HOME}/.config/i3/socket_client.py --timeout 3 "${MY_PICKER_SOCKET}" pick "${USER}");
+pickcode=$?;
+if [[ ${pickcode} -ne 0 ]]; then
+    echo "SLEEPLOCK.SH picker daemon unavailable (code ${pickcode}), running one-shot" >> ${MY_LOCK_LOG};
+    i3lockcmd=$(python3 ${HOME}/.config/i3/pick_sleep_background.py --overlay-text "${USER}");
+    pickcode=$?;
+fi
+if [[ ${pickcode} -ne 0 ]]; then
+    echo "SLEEPLOCK.SH ERROR CODE: ${pickcode}" >> ${MY_LOCK_LOG};
     echo "SLEEPLOCK.SH RETRIEVED OUTPUT: ${i3lockcmd}" >> ${MY_LOCK_LOG};
     # USE DEFAULT i3lock (minus unlock UI) to let user know the command failed / check logs
     i3lock -uef &
@@ -0,0 +1,42 @@
+# Minimal client for the resident daemons in this directory
+# USAGE: python3 -S socket_client.py [--timeout SECONDS] {socket_path} {request fields...}
+# Fields are sent tab-separated on one line; the single-line reply is printed.
+# --timeout bounds the wait for the reply (default 60s: a reachable daemon may
+# be busy, eg: rendering an overlay, and giving up early would make the
+# caller's fallback act a second time). Callers that would rather fall back
+# quickly than wait (the lock screen) pass a few seconds.
+# Exits nonzero (printing nothing) if the daemon is unreachable or replies with
+# an ERROR so callers can fall back to running the full script themselves.
+
+# Builtin modules -- keep this to the bare minimum, startup time is the point
+import socket
+import sys
+
+args = sys.argv[1:]
+reply_timeout = 60
+if len(args) > 0 and args[0] == '--timeout':
+    try:
+        reply_timeout = float(args[1])
+    except (IndexError, ValueError):
+        sys.exit(2)
+    args = args[2:]
+if len(args) < 2:
+    sys.exit(2)
+try:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(5)
+        client.connect(args[0])
+        client.sendall(('\t'.join(args[1:])+'\n').encode('utf-8'))
+        client.settimeout(reply_timeout)
+        reply = b''
+        while not reply.endswith(b'\n'):
+            chunk = client.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+except OSError:
+    sys.exit(1)
+reply = reply.decode('utf-8').rstrip('\n')
+if reply == '' or reply.startswith('ERROR'):
+    sys.exit(1)
+print(reply)
@@ -1,26 +1,56 @@
 import i3ipc
 
 import argparse
+import contextlib
 import copy
-import datetime
+import fcntl
 import json
 import logging
 import os
 import pathlib
+import socket
+import socketserver
 import subprocess
-from typing import List, Optional, Tuple, Union
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+# Local
+import desktop_entries
 
 logger = logging.getLogger(__name__)
 
-i3 = i3ipc.Connection()
+# The resident launcher (--daemon) holds this across i3 restarts
+i3 = i3ipc.Connection(auto_reconnect=True)
 
 base_path = pathlib.Path(os.getenv('HOME')) / '.config' / 'i3'
 config_path = base_path / f"{os.environ['USER']}_settings.json"
 
 DATETIME_FORMAT='%Y-%m-%d %H:%M:%S'
 
+# Executables found on PATH, per directory and keyed by the directory's mtime
+path_index_path = pathlib.Path(os.getenv('XDG_CACHE_HOME', pathlib.Path(os.getenv('HOME')) / '.cache')) / f"{os.environ['USER']}_dmenu_path_index.json"
+# In-memory copy of the index at path_index_path, loaded on first use
+path_index = None
+# In-memory copy of the shared .desktop entry index (see desktop_entries.py)
+desktop_index = None
+# Applications offered by the last menu, by Name (see desktop_candidates())
+desktop_apps = dict()
+
+# Launch frecency and the dmenu_injection name cache; kept out of the shared
+# settings file so launching doesn't rewrite it (see update_launch_history())
+launch_history_path = base_path / f"{os.environ['USER']}_launch_history.json"
+
+# Days for a launch's weight in the frecency ranking to halve (settings['dmenu_frecency_half_life'] overrides)
+FRECENCY_HALF_LIFE_DAYS = 14
+# Entries decayed below this weight are forgotten
+FRECENCY_MIN_SCORE = 0.01
+
 # Original dmenu_run is a bash script a la:
 # dmenu_path | dmenu "${@}" | ${SHELL:-"/bin/sh"} &
+# dmenu_path lists executables on PATH (stest -flx $PATH | sort -u) and caches
+# them until any PATH directory is newer than its cache; path_candidates()
+# does the same in-process, rescanning only the directories that changed
 
 # TODO: Allow commandline args to set values for launch() directly
 
@@ -40,9 +70,9 @@ def update_dmenu_settings(fname: str,
             injections.append(addition)
     return injections
 
-def populate_options() -> str:
-    # Get user's choice but allow intercepting it prior to fork for extra directives
+def search_path() -> List[str]:
     # Pass in my os.environ to hopefully include directories I add to PATH
+    # (launched programs inherit it too)
     if 'dmenu_path_addition' in settings:
         existing_path = os.environ["PATH"]
         for name in settings['dmenu_path_addition']:
@@ -56,86 +86,262 @@ def populate_options() -> str:
             if str(name) not in existing_path:
                 existing_path += f":{name}"
         os.environ["PATH"] = existing_path
-    dmenu_path = subprocess.Popen(("dmenu_path"), stdout=subprocess.PIPE, env=os.environ)
-    dmenu_choices = dmenu_path.stdout
-
-    dmenu_choices = [_.decode('utf-8') for _ in dmenu_choices.readlines()]
-
-    # Injection from settings
-    # NOTE: You have to manually delete the dmenu_path cache file and run in your own terminal (with updated PATH) to refresh any directories indicated by PATH
-    save_settings = False
-    if 'dmenu_injection' in settings:
-        for fname in settings['dmenu_injection']:
-            local_settings = settings['dmenu_injection'][fname]
-            # Load filename with ~ substitution
-            parts = list(pathlib.Path(fname).parts)
-            if parts[0] == '~':
-                parts[0] = pathlib.Path.home()
-            fpath = parts[0].joinpath(*parts[1:])
-            # Retrieve record for last-modified
+    # Empty PATH entries mean the working directory; dmenu_path skips those too
+    return list(dict.fromkeys(_ for _ in os.environ["PATH"].split(os.pathsep) if _ != ''))
+
+def scan_executables(directory: str) -> List[str]:
+    names = list()
+    with os.scandir(directory) as it:
+        for entry in it:
             try:
-                last_modified = datetime.datetime.fromtimestamp(os.stat(fpath).st_mtime)
-            except:
-                logger.error(f"Could not retrieve modified time for '{fpath}'")
+                if entry.is_file() and os.access(entry.path, os.X_OK):
+                    names.append(entry.name)
+            except OSError:
+                # Dangling symlinks etc.
                 continue
-            last_recorded = datetime.datetime.strptime(local_settings['last-modified'], DATETIME_FORMAT)
-            # Update needed
-            if last_modified > last_recorded:
-                logger.info(f"Updating dmenu injection for '{fname}' (OLD: {local_settings})")
-                local_settings['names'] = update_dmenu_settings(fname, fpath)
-                local_settings['last-modified'] = datetime.datetime.now().strftime(DATETIME_FORMAT)
-                logger.info(f"New settings: {local_settings['names']}")
-                save_settings = True
-            # Don't dupe
-            for new_name in local_settings['names']:
-                if new_name in local_settings['non-import']:
-                    logger.debug(f"Skip name '{new_name}' -- non-importable")
-                    continue
-                new_name += "\n"
-                if new_name in dmenu_choices:
-                    logger.debug(f"Skip name '{new_name.rstrip()}' -- already present")
+    return names
+
+def path_candidates(directories: List[str]) -> List[str]:
+    """
+        Sorted, unique names of executables in directories. Directories whose
+        mtime matches the index at path_index_path are not rescanned, and the
+        index is only read from disk once per process
+    """
+    global path_index
+    if path_index is None:
+        path_index = dict()
+        if path_index_path.exists():
+            try:
+                with open(path_index_path, 'r') as f:
+                    path_index = json.load(f)
+            except Exception as e:
+                logger.warning(f"Rebuilding unreadable PATH index '{path_index_path}' ({type(e)}): {e}")
+    index = path_index
+    updated = dict()
+    for directory in directories:
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            continue
+        if directory in index and index[directory]['mtime_ns'] == mtime_ns:
+            updated[directory] = index[directory]
+            continue
+        logger.info(f"Scanning PATH directory '{directory}' for executables")
+        try:
+            updated[directory] = {'mtime_ns': mtime_ns, 'names': scan_executables(directory)}
+        except OSError as e:
+            logger.error(f"Could not scan PATH directory '{directory}': {e}")
+    if updated != index:
+        path_index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path_index_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(updated, f, separators=(',', ':'))
+        os.replace(tmp_path, path_index_path)
+        path_index = updated
+    return sorted(set(name for entry in updated.values() for name in entry['names']))
+
+def desktop_candidates() -> Dict[str, dict]:
+    """
+        Visible applications from the .desktop entry index by Name. The index
+        is read from disk once per process and refreshed incrementally
+    """
+    global desktop_index
+    if desktop_index is None:
+        desktop_index = desktop_entries.load_index()
+    apps = dict()
+    for entry in desktop_entries.current_entries(desktop_index).values():
+        if entry.get('NoDisplay') == 'true':
+            continue
+        # process_choice() would split these names apart
+        if ':' in entry['Name'] or '@' in entry['Name']:
+            continue
+        apps.setdefault(entry['Name'], entry)
+    return apps
+
+def frecency_half_life() -> float:
+    return settings.get('dmenu_frecency_half_life', FRECENCY_HALF_LIFE_DAYS) * 24 * 60 * 60
+
+def frecency_score(entry: dict, now: float, half_life: float) -> float:
+    # Each launch adds 1 to the score, which then halves every half_life seconds
+    return entry['score'] * 0.5 ** ((now - entry['last']) / half_life)
+
+def empty_launch_history() -> dict:
+    return {'frecency': dict(), 'injection': dict()}
+
+def read_launch_history() -> dict:
+    """
+        {'frecency': {name: {'count': launches, 'score': score as of last, 'last': epoch seconds}},
+         'injection': {fname: {'mtime_ns': mtime of fname when read, 'names': [...]}}}
+        Writers replace the file atomically, so reading needs no lock
+    """
+    history = empty_launch_history()
+    try:
+        with open(launch_history_path, 'r') as f:
+            history.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable launch history '{launch_history_path}' ({type(e)}): {e}")
+    return history
+
+@contextlib.contextmanager
+def update_launch_history() -> Iterator[dict]:
+    """
+        Read-modify-write the launch history while holding an exclusive flock
+        on a sidecar lock file (the data file itself is replaced by each
+        write). Nothing is written unless the yielded history was changed
+    """
+    launch_history_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(launch_history_path.with_suffix('.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        history = read_launch_history()
+        original = copy.deepcopy(history)
+        yield history
+        if history != original:
+            tmp_path = launch_history_path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(history, f, separators=(',', ':'))
+            os.replace(tmp_path, launch_history_path)
+
+def migrate_launch_history(loaded: dict) -> None:
+    """
+        Move launch data older versions kept in the settings file (dmenu_recency,
+        dmenu_frecency and the dmenu_injection name cache) into the launch
+        history, rewriting the settings file once
+    """
+    recency = loaded.pop('dmenu_recency', None)
+    frecency = loaded.pop('dmenu_frecency', None)
+    stale_injections = [local_settings for local_settings in loaded.get('dmenu_injection', dict()).values()
+                        if 'names' in local_settings or 'last-modified' in local_settings]
+    if recency is None and frecency is None and len(stale_injections) == 0:
+        return
+    with update_launch_history() as history:
+        store = history['frecency']
+        for name, entry in (frecency or dict()).items():
+            store.setdefault(name, entry)
+        now = time.time()
+        for idx, name in enumerate(recency or list()):
+            if name not in store:
+                # Space out equal scores a minute apart to keep the old order
+                store[name] = {'count': 1, 'score': 1.0, 'last': round(now) - 60*idx}
+    # The name cache is rebuilt on the next menu
+    for local_settings in stale_injections:
+        local_settings.pop('names', None)
+        local_settings.pop('last-modified', None)
+    with open(config_path, 'w') as f:
+        json.dump(loaded, f, indent=1)
+    logger.info(f"Migrated launch data from '{config_path}' into '{launch_history_path}' ({len(store)} frecency entries)")
+
+def record_launch(store: dict, name: str, now: float, half_life: float) -> None:
+    if name in store:
+        entry = store[name]
+        entry['score'] = round(frecency_score(entry, now, half_life) + 1, 4)
+        entry['count'] += 1
+        entry['last'] = round(now)
+    else:
+        store[name] = {'count': 1, 'score': 1.0, 'last': round(now)}
+    for forget in [key for key, entry in store.items() if frecency_score(entry, now, half_life) < FRECENCY_MIN_SCORE]:
+        logger.debug(f"Forget '{forget}' from frecency store (decayed)")
+        del store[forget]
+
+def rank_candidates(candidates: Dict[str, None], store: dict, now: float, half_life: float) -> Iterator[str]:
+    """
+        Yield candidates with launch history first, highest decayed score
+        first, then the rest in their original order. Only the store's names
+        are sorted, so the bulk of the candidates streams straight through
+    """
+    promoted = sorted((name for name in store if name in candidates),
+                      key=lambda name: frecency_score(store[name], now, half_life),
+                      reverse=True)
+    logger.debug(f"Promote names ({promoted[:10]}...) due to frecency")
+    yield from promoted
+    promoted = set(promoted)
+    for name in candidates:
+        if name not in promoted:
+            yield name
+
+def populate_options() -> str:
+    # Get user's choice but allow intercepting it prior to fork for extra directives
+    # Start dmenu first so it sets up while candidates are gathered; it shows
+    # them once its stdin closes
+    dmenu = subprocess.Popen(("dmenu"), stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        # Ordered set of names (values unused)
+        dmenu_choices = dict.fromkeys(path_candidates(search_path()))
+
+        # Applications by their .desktop Name; executables on PATH win name clashes
+        global desktop_apps
+        desktop_apps = desktop_candidates()
+        for name in sorted(desktop_apps):
+            if name in dmenu_choices:
+                del desktop_apps[name]
+            else:
+                dmenu_choices[name] = None
+
+        # Injection from settings, names cached in the launch history per file
+        history = read_launch_history()
+        injected = dict()
+        if 'dmenu_injection' in settings:
+            for fname in settings['dmenu_injection']:
+                local_settings = settings['dmenu_injection'][fname]
+                # Load filename with ~ substitution
+                parts = list(pathlib.Path(fname).parts)
+                if parts[0] == '~':
+                    parts[0] = pathlib.Path.home()
+                fpath = pathlib.Path(parts[0]).joinpath(*parts[1:])
+                # Retrieve record for last-modified
+                try:
+                    mtime_ns = os.stat(fpath).st_mtime_ns
+                except:
+                    logger.error(f"Could not retrieve modified time for '{fpath}'")
                     continue
-                logger.info(f"Inject name '{new_name.rstrip()}' from '{fname}'")
-                dmenu_choices.append(new_name)
-
-    # Remove any remove-list items
-    print("".join(dmenu_choices))
-    if 'dmenu_remove' in settings:
-        logger.debug(f"Removing entries from dmenu choices based on settings['dmenu_remove']: {settings['dmenu_remove']}")
-        for entry in settings['dmenu_remove']:
-            entry_ = entry+'\n'
-            if entry_ in dmenu_choices:
-                dmenu_choices.remove(entry_)
-
-    # Let's try recency bias first (no timestamps, just order of usage)
-    if 'dmenu_recency' in settings:
-        reinclude = list()
-        for entry in settings['dmenu_recency']:
-            entry_ = entry+'\n'
-            if entry_ in dmenu_choices:
-                reinclude.append(entry_)
-                dmenu_choices.remove(entry_)
-            # Could tidy up settings['dmenu_recency'] if you want to, but I think not for now
-        logger.debug(f"Promote names ({reinclude}) due to recency")
-        dmenu_choices = reinclude + dmenu_choices
-
-    # TODO: Add history of selections to prioritize most-recent/frequent prefix
-    # You can pipe a whole bunch of things together to get priority sorting into dmenu once you track choices
-    # echo this list (as "#used, item" pairs) into:
-    #    sort -r (invert order)
-    #    awk '{printf("%d %s\n", $1 * FREQUENCY_WEIGHT + NR, $2)}' (add list-order as tiebreaker, but multiply usage amount as 1M in aario/dmenu -- I think FREQ_WEIGHT >= len(list) is sufficient
-    #    sort -n -r (un-invert order but sort numerically based on weight key)
-    #    awk '{print $NF}' (print just the items, now in sorted order)
-    #
-    # Dmenu will preserve the sorting order as it prunes items down
-    # Join
-    dmenu_choices = "".join(dmenu_choices)
-
-    if save_settings:
-        with open(config_path, 'w') as f:
-            json.dump(settings, f, indent=1)
-
-    choice = subprocess.check_output(("dmenu"), input=dmenu_choices, text=True).rstrip()
+                cached = history['injection'].get(fname)
+                # Update needed
+                if cached is None or cached['mtime_ns'] != mtime_ns:
+                    logger.info(f"Updating dmenu injection for '{fname}' (OLD: {cached})")
+                    cached = {'mtime_ns': mtime_ns, 'names': update_dmenu_settings(fname, fpath)}
+                    logger.info(f"New names: {cached['names']}")
+                    injected[fname] = cached
+                # Don't dupe
+                non_import = set(local_settings.get('non-import', list()))
+                for new_name in cached['names']:
+                    if new_name in non_import:
+                        logger.debug(f"Skip name '{new_name}' -- non-importable")
+                        continue
+                    if new_name in dmenu_choices:
+                        logger.debug(f"Skip name '{new_name}' -- already present")
+                        continue
+                    logger.info(f"Inject name '{new_name}' from '{fname}'")
+                    dmenu_choices[new_name] = None
+
+        # Remove any remove-list items
+        if 'dmenu_remove' in settings:
+            logger.debug(f"Removing entries from dmenu choices based on settings['dmenu_remove']: {settings['dmenu_remove']}")
+            for entry in settings['dmenu_remove']:
+                dmenu_choices.pop(entry, None)
+
+        # Frecency bias: frequently and recently launched names first
+        # Dmenu will preserve the sorting order as it prunes items down
+        try:
+            for name in rank_candidates(dmenu_choices, history['frecency'], time.time(), frecency_half_life()):
+                dmenu.stdin.write(f"{name}\n")
+            dmenu.stdin.close()
+        except BrokenPipeError:
+            logger.error("dmenu exited before reading all choices")
+    except Exception:
+        # Don't leave dmenu waiting on choices that will never come
+        dmenu.kill()
+        dmenu.wait()
+        raise
+
+    if len(injected) > 0:
+        with update_launch_history() as history:
+            history['injection'].update(injected)
+
+    choice = dmenu.stdout.read().rstrip()
+    if dmenu.wait() != 0:
+        # Nothing chosen (eg: escape)
+        raise subprocess.CalledProcessError(dmenu.returncode, "dmenu", output=choice)
     return choice
 
 def process_choice(choice: str,
@@ -182,8 +388,20 @@ def process_choice(choice: str,
     if prog_args is not None:
         prog_args = prog_args.split(' ')
 
+    # Applications chosen by .desktop Name run their Exec line (plus any given
+    # arguments), in a terminal if the entry asks for one (Terminal=true)
+    desktop_terminal = False
+    if program in desktop_apps:
+        desktop_terminal = desktop_apps[program].get('Terminal') == 'true'
+        argv = desktop_entries.exec_argv(desktop_apps[program])
+        logger.debug(f"Desktop entry '{desktop_apps[program]['path']}' runs {argv}")
+        program = argv[0]
+        prog_args = argv[1:] + (prog_args if prog_args is not None else list())
+        if len(prog_args) == 0:
+            prog_args = None
+
     # Some programs need to be executed within a terminal for you to observe what happens
-    if 'requires_terminal' in settings and program in settings['requires_terminal']:
+    if desktop_terminal or ('requires_terminal' in settings and program in settings['requires_terminal']):
         if prog_args is not None:
             if prog_args[-1] == ('&'):
                 silent_terminal = True
@@ -251,15 +469,10 @@ def launch(signal: Optional[int],
         status = subprocess.run(("i3-msg", "-t", "send_tick", f"automanager::no_default"))
         if status.returncode != 0:
             logger.error(f"Failed to signal automanager: {status.returncode}")
-    # Update recency settings
-    if 'dmenu_recency' not in settings:
-        settings['dmenu_recency'] = list()
-    if recency_program in settings['dmenu_recency']:
-        settings['dmenu_recency'].remove(recency_program)
+    # Update frecency
     if recency_program is not None:
-        settings['dmenu_recency'].insert(0,recency_program)
-    with open(config_path, 'w') as f:
-        json.dump(settings, f, indent=1)
+        with update_launch_history() as history:
+            record_launch(history['frecency'], recency_program, time.time(), frecency_half_life())
 
     # Form program with arguments
     if prog_args is not None:
@@ -267,7 +480,8 @@ def launch(signal: Optional[int],
         program.extend(prog_args)
     # Run program as expected and exit this process
     logger.info(f"Launch program '{program}'")
-    proc = subprocess.Popen(program)
+    # Own session so the program outlives (and is not signalled with) the resident launcher
+    proc = subprocess.Popen(program, start_new_session=True)
     # If these aren't the same, it's a terminal that will execvp or something;
     # You can only detach if you own the process ID created by the program!
     if program == recency_program and hasattr(proc, 'detach'):
@@ -277,6 +491,127 @@ def launch(signal: Optional[int],
     # shut it down. Perhaps I can move it to some 'junk' workspace that won't
     # be bothersome?
 
+def load_settings() -> dict:
+    global path_index, desktop_index
+    logger.info(f"Fetch configuration from '{config_path}'")
+    with open(config_path,"r") as f:
+        loaded = json.load(f)
+    logger.info(f"Settings loaded: {loaded}")
+    migrate_launch_history(loaded)
+    # Force a full rescan of PATH and of the .desktop entries (eg: after
+    # changing a file's executable bit, which does not change its directory's mtime)
+    if 'clear_dmenu_cache' in loaded and loaded['clear_dmenu_cache']:
+        path_index = None
+        desktop_index = None
+        for cache in [path_index_path, desktop_entries.index_path]:
+            try:
+                cache.unlink(missing_ok=True)
+                logger.info(f"Cleared index at '{cache}'")
+            except:
+                logger.error(f"Tried to unlink index at '{cache}', but failed")
+    return loaded
+
+# Resident launcher: requests are one line of tab-separated fields, answered by one line:
+#   "menu" -> "ok" (answered before dmenu opens, so the client never waits on
+#             the user) or "busy" when a menu is already open
+#   "ping" -> "pong"
+# Failures are answered with a line starting with "ERROR" so the client can
+# fall back to a one-shot run
+default_socket_path = pathlib.Path(os.getenv('XDG_RUNTIME_DIR', '/tmp')) / f"{os.environ['USER']}_special_dmenu_handler.sock"
+
+class LauncherState:
+    """
+        Settings kept hot between menus; they are reloaded only when the
+        settings file changes underneath us. The PATH index (path_index), the
+        .desktop entry index (desktop_index) and the i3 connection are module
+        state and stay warm on their own.
+    """
+    def __init__(self):
+        self.settings_mtime_ns = None
+        # Held while dmenu is open so repeated keypresses don't stack menus
+        self.menu_lock = threading.Lock()
+
+    def refresh(self) -> None:
+        global settings
+        mtime_ns = os.stat(config_path).st_mtime_ns
+        if mtime_ns != self.settings_mtime_ns:
+            settings = load_settings()
+            # Loading may have migrated (rewritten) the file
+            self.settings_mtime_ns = os.stat(config_path).st_mtime_ns
+
+    def menu(self) -> None:
+        try:
+            launch(*process_choice(populate_options()))
+        except subprocess.CalledProcessError:
+            logger.info("dmenu closed without a choice")
+
+class LauncherRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        request = self.rfile.readline().decode('utf-8').rstrip('\n').split('\t')
+        logger.info(f"Daemon request: {request}")
+        state = self.server.state
+        menu = False
+        try:
+            if request[0] == 'menu':
+                if state.menu_lock.acquire(blocking=False):
+                    try:
+                        state.refresh()
+                    except Exception:
+                        state.menu_lock.release()
+                        raise
+                    menu = True
+                    reply = 'ok'
+                else:
+                    reply = 'busy'
+            elif request[0] == 'ping':
+                reply = 'pong'
+            else:
+                reply = f"ERROR unknown request '{request[0]}'"
+        except Exception as e:
+            logger.error(f"Daemon failed to handle request {request} ({type(e)}): {e}")
+            # Start from disk again on the next request
+            state.settings_mtime_ns = None
+            reply = f"ERROR {type(e).__name__}"
+        self.wfile.write((reply+'\n').encode('utf-8'))
+        self.wfile.flush()
+        if not menu:
+            return
+        try:
+            state.menu()
+        except Exception as e:
+            logger.error(f"Daemon failed to show or launch from dmenu ({type(e)}): {e}")
+        finally:
+            state.menu_lock.release()
+
+def run_daemon(socket_path: pathlib.Path = default_socket_path) -> None:
+    # Refuse to start twice; a socket file nobody answers on is stale
+    if socket_path.exists():
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                probe.connect(str(socket_path))
+            logger.error(f"Daemon already listening on {socket_path}")
+            return
+        except OSError:
+            socket_path.unlink()
+    # Threaded so a "busy" answer isn't queued behind an open menu
+    server = socketserver.ThreadingUnixStreamServer(str(socket_path), LauncherRequestHandler)
+    server.daemon_threads = True
+    server.state = LauncherState()
+    try:
+        # Warm everything up front so the first menu is as fast as the rest
+        server.state.refresh()
+        path_candidates(search_path())
+        desktop_candidates()
+    except Exception as e:
+        logger.error(f"Daemon could not preload settings ({type(e)}): {e}")
+        server.state.settings_mtime_ns = None
+    logger.info(f"Daemon listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        socket_path.unlink(missing_ok=True)
+
 def build() -> argparse.ArgumentParser:
     prs = argparse.ArgumentParser()
     prs.add_argument('--workspace', type=int, default=None, help="Workspace to launch on")
@@ -284,6 +619,7 @@ def build() -> argparse.ArgumentParser:
     prs.add_argument('--recency-program', type=str, default=None, help="Specify == program if detach() should be called (ie: terminals)")
     prs.add_argument('--args', type=str, nargs="*", default=None, action='append', help="Arguments to the program")
     prs.add_argument('--silent-terminal', action='store_true', help="Hide terminals -- TBD feature")
+    prs.add_argument('--daemon', action='store_true', help=f"Stay resident and show the menu on request over a Unix socket at {default_socket_path}")
     return prs
 
 def parse(args: Optional[argparse.Namespace] = None,
@@ -302,20 +638,13 @@ if __name__ == '__main__':
                         level=logging.DEBUG,
                         format="%(asctime)s %(levelname)s: %(message)s",
                         datefmt=DATETIME_FORMAT)
+    args = parse()
+    if args.daemon:
+        run_daemon()
+        exit(0)
     # Fetch settings
-    logger.info(f"Fetch configuration from '{config_path}'")
-    with open(config_path,"r") as f:
-        settings = json.load(f)
-    logger.info(f"Settings loaded: {settings}")
-    if 'clear_dmenu_cache' in settings and settings['clear_dmenu_cache']:
-        cached_path = pathlib.Path(os.environ['HOME']).joinpath('.cache','dmenu_run')
-        try:
-            cached_path.unlink()
-            logger.info(f"Cleared dmenu_path cache at '{cache_path}'")
-        except:
-            logger.error(f"Tried to unlink dmenu_path cache at '{cached_path}', but failed")
+    settings = load_settings()
 
-    args = parse()
     if args.program is not None:
         if args.workspace is not None:
             # Have to find the one
@@ -3,12 +3,16 @@ import simpleobsws
 from i3ipc.aio import Connection
 from i3ipc import Event
 
-# Local
-import obs_ws_config as cfg
-
 # Builtin
 import asyncio
 import pathlib
+import sys
+
+# Local
+import obs_ws_config as cfg
+# Shared .desktop entry index, installed with the i3 config (see the top-level README)
+sys.path.append(str(pathlib.Path('~/.config/i3').expanduser()))
+import desktop_entries
 
 #async def notify_send_recording_done_msg(eventType, eventData):
 #    print(f"New event! Type: '{eventType}' Raw Data: {eventData}")
@@ -16,19 +20,8 @@ import pathlib
 class i3OBSManager:
     def __init__(self):
         # Index steam games to set identifiers
-        self.known_steam_apps = dict()
-        for fpath in pathlib.Path('~/.local/share/applications/').expanduser().iterdir():
-            if fpath.suffix == '.desktop':
-                with open(fpath, 'r') as f:
-                    name = None
-                    for line in f.readlines():
-                        if line.startswith('Name='):
-                            name = line.rstrip().split('=',1)[1]
-                        if line.startswith('Exec='):
-                            if 'steam' in line:
-                                gameid = line.rstrip().rsplit('/',1)[1]
-                                self.known_steam_apps[gameid] = name
-                            break
+        self.desktop_index = desktop_entries.load_index()
+        self.refresh_steam_apps()
         print(f"Found steam games: {self.known_steam_apps}")
 
         # Set up AIO loop
@@ -36,6 +29,14 @@ class i3OBSManager:
         self.loop.run_until_complete(self.make_connections())
         self.loop.run_forever() # Hold event loop open until stop() is called
 
+    def refresh_steam_apps(self):
+        # Steam's shortcuts run "steam steam://rungameid/<id>"
+        self.known_steam_apps = dict()
+        for entry in desktop_entries.current_entries(self.desktop_index).values():
+            if 'steam://rungameid/' in entry['Exec']:
+                gameid = entry['Exec'].rsplit('/',1)[1]
+                self.known_steam_apps[gameid] = entry['Name']
+
     async def make_connections(self):
         parameters = simpleobsws.IdentificationParameters()
         # Must subscribe to event categories you need:
@@ -85,6 +86,9 @@ class i3OBSManager:
         # Edit the workspace name if it's in a known steam ID
         if workspace_name.startswith('steam_app_'):
             workspace_suffix = workspace_name[len('steam_app_'):]
+            if workspace_suffix not in self.known_steam_apps:
+                # Installed since the last refresh? (Unknown ids are then remembered as-is)
+                self.refresh_steam_apps()
             workspace_name = self.known_steam_apps.setdefault(workspace_suffix, workspace_suffix)
         else:
             workspace_name = workspace_name.capitalize()